@@ -0,0 +1,287 @@
+"""Synthetic mall websites served from a local HTTP server, for offline benchmarks"""
+import gzip
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LANGUAGES = ['en', 'fr', 'es']
+STORE_SEGMENTS = {'en': 'stores', 'fr': 'boutiques', 'es': 'tiendas'}
+CATEGORIES = ['Fashion', 'Food', 'Electronics', 'Beauty', 'Sports', 'Home']
+
+
+def store_slug(i):
+    return f"store-{i}"
+
+
+def store_name(i):
+    return f"Store {i}"
+
+
+class FixtureSite:
+    """
+    One synthetic mall site. Paths:
+      /robots.txt, /sitemap_index.xml (nested index), /sitemap.xml, /sitemaps/*.xml[.gz],
+      /, /<lang>/<stores>/ (directory), /<lang>/<stores>/store-N/ (store page), /<lang>/news/N/
+    delay: seconds to sleep before every response (slow host)
+    error_every: every Nth path (by hash) answers 500, robots/sitemaps included (erroring host)
+    """
+
+    def __init__(self, name, n_stores=1000, per_sitemap=10000, delay=0.0, error_every=0, directory_size=200):
+        self.name = name
+        self.n_stores = n_stores
+        self.per_sitemap = per_sitemap
+        self.delay = delay
+        self.error_every = error_every
+        self.directory_size = directory_size
+        self.base = None
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    # --- URL sets ---------------------------------------------------------
+
+    def store_url(self, lang, i):
+        return f"{self.base}/{lang}/{STORE_SEGMENTS[lang]}/{store_slug(i)}/"
+
+    def page_urls(self):
+        urls = [f"{self.base}/"]
+        for lang in LANGUAGES:
+            urls.append(f"{self.base}/{lang}/{STORE_SEGMENTS[lang]}/")
+            urls.append(f"{self.base}/{lang}/contact/")
+            urls.extend(f"{self.base}/{lang}/news/{n}/" for n in range(20))
+        return urls
+
+    def store_sitemap_count(self):
+        return max(1, -(-self.n_stores * len(LANGUAGES) // self.per_sitemap))
+
+    def store_sitemap_urls(self, index):
+        start = index * self.per_sitemap
+        stop = min(start + self.per_sitemap, self.n_stores * len(LANGUAGES))
+        for k in range(start, stop):
+            yield self.store_url(LANGUAGES[k % len(LANGUAGES)], k // len(LANGUAGES))
+
+    # --- documents --------------------------------------------------------
+
+    def urlset(self, urls, alternates=None):
+        alternates = alternates or {}
+        body = ''.join(
+            f"<url><loc>{u}</loc>"
+            + ''.join(f'<xhtml:link rel="alternate" hreflang="{l}" href="{a}"/>' for l, a in alternates.get(u, ()))
+            + "</url>" for u in urls)
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+                'xmlns:xhtml="http://www.w3.org/1999/xhtml">' + body + '</urlset>')
+
+    def directory_alternates(self):
+        """hreflang alternates of the directory pages, as a CMS sitemap plugin would list them"""
+        urls = {l: f"{self.base}/{l}/{STORE_SEGMENTS[l]}/" for l in LANGUAGES}
+        return {u: [(l, a) for l, a in urls.items()] for u in urls.values()}
+
+    def sitemapindex(self, locs):
+        body = ''.join(f"<sitemap><loc>{u}</loc></sitemap>" for u in locs)
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">' + body + '</sitemapindex>')
+
+    def store_sitemap_path(self, index):
+        # Every third child sitemap is a gzip file, like many CMS exports
+        return f"/sitemaps/stores-{index}.xml.gz" if index % 3 == 2 else f"/sitemaps/stores-{index}.xml"
+
+    def homepage(self):
+        links = ''.join(f'<a href="{u}">{u}</a>' for u in self.page_urls())
+        return (f"<html><head><title>{self.name} Mall - Official Site</title>"
+                f'<link rel="canonical" href="{self.base}/"></head>'
+                f"<body><div class='cookie-banner'>We use cookies. Accept all cookies to continue.</div>"
+                f"<nav>{links}</nav><main><h1>Welcome to {self.name} Mall</h1></main></body></html>")
+
+    def directory_page(self, lang):
+        cards = []
+        for i in range(min(self.directory_size, self.n_stores)):
+            cards.append(
+                f'<li class="store-card"><a href="{self.store_url(lang, i)}">'
+                f'<span class="store-name">{store_name(i)}</span></a>'
+                f'<span class="unit">Unit {100 + i}</span>'
+                f'<span class="category">{CATEGORIES[i % len(CATEGORIES)]}</span></li>')
+        return (f"<html><head><title>Stores - {self.name} Mall</title></head><body>"
+                f"<div class='cookie-banner'>We use cookies. Accept all cookies to continue.</div>"
+                f"<header>{self.name} Mall | Hours | Directions</header>"
+                f"<ul class='store-list'>{''.join(cards)}</ul><footer>(c) {self.name} Mall</footer></body></html>")
+
+    def store_page(self, lang, i):
+        name = store_name(i)
+        category = CATEGORIES[i % len(CATEGORIES)]
+        jsonld = ''
+        if i % 2 == 0:
+            jsonld = ('<script type="application/ld+json">' + json.dumps({
+                "@context": "https://schema.org", "@type": "Store", "name": name,
+                "telephone": f"+1 555 {i:04d}", "openingHours": "Mo-Sa 10:00-21:00",
+            }) + '</script>')
+        boilerplate = ' '.join(f"{self.name} Mall offers parking, dining and events for the whole family." for _ in range(40))
+        alternates = ''.join(f'<link rel="alternate" hreflang="{l}" href="{self.store_url(l, i)}">' for l in LANGUAGES)
+        return (f"<html lang='{lang}'><head><title>{name} | {self.name} Mall</title>{alternates}{jsonld}</head><body>"
+                f"<div class='cookie-banner'>We use cookies. Accept all cookies to continue. "
+                f"Manage preferences. Privacy policy.</div>"
+                f"<div class='promo'>{boilerplate}</div>"
+                f"<article><h1>{name}</h1><p>{name} sells {category.lower()} products. "
+                f"Phone: +1 555 {i:04d}. Hours: Mon-Sat 10am-9pm. Location: Level 1, Unit {100 + i}.</p></article>"
+                f"</body></html>")
+
+    # --- routing ----------------------------------------------------------
+
+    def is_error(self, path):
+        if not self.error_every:
+            return False
+        return int(hashlib.md5(path.encode()).hexdigest(), 16) % self.error_every == 0
+
+    def render(self, path):
+        """Return (status, content_type, body_bytes, gzip_allowed)"""
+        with self._lock:
+            if path in self._cache:
+                return self._cache[path]
+        result = self._render(path)
+        if path.startswith('/sitemap'):
+            with self._lock:
+                self._cache[path] = result
+        return result
+
+    def _render(self, path):
+        if path == '/robots.txt':
+            return 200, 'text/plain', f"User-agent: *\nSitemap: {self.base}/sitemap_index.xml\n".encode(), False
+        if path == '/sitemap_index.xml':
+            xml = self.sitemapindex([f"{self.base}/sitemaps/stores-index.xml", f"{self.base}/sitemaps/pages.xml"])
+            return 200, 'application/xml', xml.encode(), True
+        if path == '/sitemap.xml':
+            return 200, 'application/xml', self.urlset(self.page_urls()).encode(), True
+        if path == '/sitemaps/stores-index.xml':
+            locs = [self.base + self.store_sitemap_path(i) for i in range(self.store_sitemap_count())]
+            return 200, 'application/xml', self.sitemapindex(locs).encode(), True
+        if path == '/sitemaps/pages.xml':
+            return 200, 'application/xml', self.urlset(self.page_urls(), self.directory_alternates()).encode(), True
+        if path.startswith('/sitemaps/stores-'):
+            name = path[len('/sitemaps/stores-'):]
+            index = int(name.split('.')[0])
+            xml = self.urlset(self.store_sitemap_urls(index)).encode()
+            if name.endswith('.gz'):
+                return 200, 'application/x-gzip', gzip.compress(xml, compresslevel=1), False
+            return 200, 'application/xml', xml, True
+        if path == '/':
+            return 200, 'text/html; charset=utf-8', self.homepage().encode(), True
+
+        segments = [s for s in path.split('/') if s]
+        if len(segments) >= 2 and segments[0] in STORE_SEGMENTS and segments[1] == STORE_SEGMENTS[segments[0]]:
+            lang = segments[0]
+            if len(segments) == 2:
+                return 200, 'text/html; charset=utf-8', self.directory_page(lang).encode(), True
+            if segments[2].startswith('store-'):
+                i = int(segments[2][len('store-'):])
+                if i < self.n_stores:
+                    return 200, 'text/html; charset=utf-8', self.store_page(lang, i).encode(), True
+        if len(segments) >= 2 and segments[1] in ('news', 'contact'):
+            return 200, 'text/html; charset=utf-8', b"<html><body><h1>News</h1></body></html>", True
+        return 404, 'text/html', b"<html><body>Not found</body></html>", False
+
+
+def duckduckgo_page(query, sites):
+    """A DuckDuckGo html results page listing aggregators first, then the fixture sites"""
+    results = [
+        ('Best malls near you - Reviews', 'https://www.yelp.example/search?q=' + query.replace(' ', '+')),
+        (f'{query} - Directory', 'https://mallsdirectory.example/' + query.replace(' ', '-')),
+    ]
+    results += [(f"{site.name} Mall - Official Site | Home", site.base + '/') for site in sites]
+    links = ''.join(f'<div class="result"><a class="result__a" href="{url}">{title}</a></div>' for title, url in results)
+    return f"<html><body>{links}</body></html>".encode()
+
+
+def make_handler(site, search_sites=()):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status, content_type, body, gzip_allowed, include_body=True):
+            if gzip_allowed and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body, compresslevel=1)
+                encoding = 'gzip'
+            else:
+                encoding = None
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.end_headers()
+            if include_body:
+                self.wfile.write(body)
+
+        def respond(self, include_body=True):
+            if site.delay:
+                time.sleep(site.delay)
+            path = self.path.split('?')[0]
+            if site.is_error(path):
+                return self.send_body(500, 'text/plain', b"Internal Server Error", False, include_body)
+            self.send_body(*site.render(path), include_body=include_body)
+
+        def do_GET(self):
+            self.respond()
+
+        def do_HEAD(self):
+            self.respond(include_body=False)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            form = self.rfile.read(length).decode()
+            if self.path.startswith('/html'):
+                from urllib.parse import parse_qs
+                query = parse_qs(form).get('q', [''])[0]
+                return self.send_body(200, 'text/html', duckduckgo_page(query, search_sites), False)
+            self.send_body(404, 'text/plain', b"Not found", False)
+
+    return Handler
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # clients that stop reading early (byte caps, HEAD probes) reset connections
+
+
+class FixtureServer:
+    """Starts one local HTTP server per site, each on its own port (i.e. its own netloc)"""
+
+    def __init__(self, sites):
+        self.sites = {site.name: site for site in sites}
+        self.servers = []
+
+    def start(self):
+        for site in self.sites.values():
+            server = QuietServer(('127.0.0.1', 0), make_handler(site, list(self.sites.values())))
+            site.base = f"http://127.0.0.1:{server.server_port}"
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def __getitem__(self, name):
+        return self.sites[name]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def default_sites(n_stores=40000):
+    """big: 100k+ URLs over a nested, partly gzipped sitemap index. slow and broken: small sites with bad hosts"""
+    return [
+        FixtureSite('big', n_stores=n_stores),
+        FixtureSite('small', n_stores=200),
+        FixtureSite('slow', n_stores=200, delay=0.2),
+        FixtureSite('broken', n_stores=200, error_every=3),
+    ]
@@ -0,0 +1,172 @@
+"""
+Offline benchmarks against local fixture sites and a stub LLM.
+
+Run from the repository root:
+    python -m benchmarks.run                      # run everything, print a table
+    python -m benchmarks.run --only crawl         # benchmarks whose name contains "crawl"
+    python -m benchmarks.run --save-baseline      # store results in benchmarks/baseline.json
+    python -m benchmarks.run --compare            # compare against the stored baseline
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks import stub_llm
+from benchmarks.fixtures import STORE_SEGMENTS, FixtureServer, default_sites
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def measure(name, fn, iterations, units=None, quiet=True):
+    """Call fn iterations times; units(result) counts work items (e.g. URLs) for throughput"""
+    latencies = []
+    total_units = 0
+    sink = open(os.devnull, 'w') if quiet else None
+    try:
+        for _ in range(iterations):
+            with contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext():
+                start = time.perf_counter()
+                result = fn()
+                latencies.append(time.perf_counter() - start)
+            total_units += units(result) if units else 1
+    finally:
+        if sink:
+            sink.close()
+
+    elapsed = sum(latencies)
+    return {
+        'name': name,
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(elapsed / iterations * 1000, 2),
+        'throughput_per_s': round(total_units / elapsed, 2) if elapsed else 0.0,
+        'units': total_units,
+    }
+
+
+def build_benchmarks(server, iterations):
+    """(name, fn, iterations, units) for every benchmark. Imports happen here, after stubs are set up"""
+    import brandmatch
+    import crawlerai2
+    import llm_backend
+    import searchmall
+    import site_profile
+    import url_classifier
+
+    # Every service's call_llama runs for real, answered by the stub backend
+    llm_backend.register_backend('stub', stub_llm.backend())
+    llm_backend.DEFAULT_BACKEND = 'stub'
+    llm_backend.routes.clear()
+    crawlerai2.min_request_interval = 0
+    # No trained URL classifier: every URL goes to the (stub) LLM, and its verdicts stay out of the repo
+    url_classifier.CLASSIFIER_DIR = tempfile.mkdtemp(prefix='url_classifier-')
+    # Fixture sites (127.0.0.1_<port>) get fresh profiles each run, outside the working tree
+    site_profile.PROFILE_DIR = tempfile.mkdtemp(prefix='site_profiles-')
+    searchmall.DUCKDUCKGO_SEARCH_URL = server['small'].base + '/html/'
+    searchmall.SEARCH_MIN_INTERVAL = 0
+
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+        big_urls = crawlerai2.crawl_website(server['big'].base + '/')
+        small_urls = crawlerai2.crawl_website(server['small'].base + '/')
+    client = crawlerai2.app.test_client()
+    big, small, slow, broken = server['big'], server['small'], server['slow'], server['broken']
+
+    def parse_shop(url):
+        return lambda: client.get('/parse-shop', query_string={'url': url}).get_json()
+
+    def filter_links(site):
+        # Served from the crawl cache the setup crawl filled
+        body = {'url': site.base + '/', 'roots': [f"/{lang}/{STORE_SEGMENTS[lang]}/" for lang in STORE_SEGMENTS]}
+        return lambda: client.post('/filter-links', json=body).get_json()
+
+    def extract_directory(site, lang):
+        url = f"{site.base}/{lang}/{STORE_SEGMENTS[lang]}/"
+        return lambda: client.get('/extract-directory', query_string={'url': url}).get_json()
+
+    brand_names = brandmatch.brand_df["BRAND NAME"].tolist()
+    queries = [name.lower()[:-1] for name in brand_names[:50]] or ['adidas']
+
+    def brand_matches():
+        return [brandmatch.extract_best_brand_match(q) for q in queries]
+
+    return [
+        ('crawl_website[big]', lambda: crawlerai2.crawl_website(big.base + '/'), max(1, iterations // 10), len),
+        ('crawl_website[slow]', lambda: crawlerai2.crawl_website(slow.base + '/'), max(1, iterations // 5), len),
+        ('crawl_website[broken]', lambda: crawlerai2.crawl_website(broken.base + '/'), iterations, len),
+        ('find_directory_pages[big]', lambda: crawlerai2.find_directory_pages(big_urls), max(1, iterations // 5), None),
+        ('find_directory_pages[small]', lambda: crawlerai2.find_directory_pages(small_urls), iterations, None),
+        ('find_store_roots[big]', lambda: crawlerai2.find_store_roots(big_urls), max(1, iterations // 5), None),
+        ('filter_links[big,3 roots]', filter_links(big), iterations, lambda r: r.get('filtered_count', 0)),
+        ('parse_shop[jsonld]', parse_shop(big.store_url('en', 0)), iterations, None),
+        ('parse_shop[plain]', parse_shop(big.store_url('en', 1)), iterations, None),
+        ('parse_shop[slow]', parse_shop(slow.store_url('en', 1)), max(1, iterations // 5), None),
+        ('parse_shop[missing]', parse_shop(small.base + '/en/stores/store-99999/'), max(1, iterations // 5), None),
+        ('extract_directory[big]', extract_directory(big, 'en'), iterations, lambda r: r.get('store_count', 0)),
+        ('extract_directory[broken]', extract_directory(broken, 'fr'), iterations, lambda r: r.get('store_count', 0)),
+        ('extract_best_brand_match', brand_matches, max(1, iterations // 5), len),
+        ('search_duckduckgo', lambda: searchmall.search_duckduckgo('Big Mall 1 Main St'), iterations, None),
+    ]
+
+
+def print_table(results, baseline=None):
+    header = f"{'benchmark':32} {'iters':>5} {'p50 ms':>10} {'p99 ms':>10} {'thru/s':>12}"
+    if baseline:
+        header += f" {'p50 vs base':>12}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        line = f"{r['name']:32} {r['iterations']:>5} {r['p50_ms']:>10.2f} {r['p99_ms']:>10.2f} {r['throughput_per_s']:>12.2f}"
+        if baseline:
+            base = baseline.get(r['name'])
+            line += f" {r['p50_ms'] / base['p50_ms']:>11.2f}x" if base and base['p50_ms'] else f" {'-':>12}"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--stores', type=int, default=40000, help='stores on the big site (x3 languages)')
+    parser.add_argument('--only', help='run benchmarks whose name contains this text')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--compare', action='store_true')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--verbose', action='store_true', help="don't silence service output")
+    args = parser.parse_args(argv)
+
+    with FixtureServer(default_sites(n_stores=args.stores)) as server:
+        results = []
+        for name, fn, iterations, units in build_benchmarks(server, args.iterations):
+            if args.only and args.only not in name:
+                continue
+            result = measure(name, fn, iterations, units, quiet=not args.verbose)
+            results.append(result)
+            print(f"{name}: p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms", file=sys.stderr)
+
+    baseline = None
+    if args.compare and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = {r['name']: r for r in json.load(f)['results']}
+    print_table(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'stores': args.stores,
+                       'iterations': args.iterations, 'results': results}, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Deterministic LLM answers for the stub backend, so benchmarks measure our code and not the provider"""
+import json
+import os
+import re
+
+# Simulated provider latency per call, in seconds
+STUB_LATENCY = float(os.environ.get("BENCH_LLM_LATENCY", 0))
+
+DIRECTORY_HINT = re.compile(r'/(stores|boutiques|tiendas|directory|shops)/?$', re.IGNORECASE)
+PREFIX_LABEL = re.compile(r'^\s*\{(\w+)\} = (\S+)\s*$', re.MULTILINE)
+LISTED_URL = re.compile(r'^\s*(\d+)\. \{(\w+)\}(\S*)\s*$', re.MULTILINE)
+LISTED_FIELD = re.compile(r'^"([^"]+)": \[', re.MULTILINE)
+FIELD_LABELS = [('name', 'store_name'), ('unit', 'unit'), ('categ', 'category'), ('phone', 'phone'), ('hour', 'hours')]
+
+
+def stub_completion(prompt):
+    """Return the text a well-behaved model would answer for the prompts our services send"""
+    prefixes = dict(PREFIX_LABEL.findall(prompt))
+    listed = [(int(n), prefixes.get(name, '') + rest) for n, name, rest in LISTED_URL.findall(prompt)]
+
+    if '"directory_candidates"' in prompt:
+        picks = [n for n, u in listed if DIRECTORY_HINT.search(u)][:10]
+        return "```json\n" + json.dumps({"directory_candidates": picks}) + "\n```"
+    if '"final_directories"' in prompt:
+        picks = [n for n, u in listed if DIRECTORY_HINT.search(u)]
+        return json.dumps({"final_directories": picks})
+    if '"store_roots"' in prompt:
+        return json.dumps({"store_roots": [n for n, u in listed]})
+    if '"labels"' in prompt:
+        labels = {}
+        for field in LISTED_FIELD.findall(prompt):
+            labels[field] = next((label for hint, label in FIELD_LABELS if hint in field.lower()), 'ignore')
+        return json.dumps({"labels": labels})
+    if '"store_name"' in prompt:
+        name = re.search(r'(Store \d+)', prompt)
+        phone = re.search(r'(\+1 555 \d{4})', prompt)
+        return "```json\n" + json.dumps({
+            "store_name": name.group(1) if name else None,
+            "description": None,
+            "phone": phone.group(1) if phone else None,
+            "hours": None, "website": None, "email": None, "location": None,
+            "categories": [], "services": []
+        }) + "\n```"
+    if '"match"' in prompt:
+        return json.dumps({"match": "NONE"})
+    return "{}"
+
+
+
+def backend():
+    """llm_backend.StubBackend that answers like stub_completion, after BENCH_LLM_LATENCY seconds"""
+    import llm_backend
+    return llm_backend.StubBackend(stub_completion, STUB_LATENCY)
@@ -1,39 +1,49 @@
 from flask import Flask, request, jsonify
 import pandas as pd
-import json
-from huggingface_hub import InferenceClient
 from dotenv import load_dotenv
 from fuzzywuzzy import process
-import os
+
+import export
+import json_stream
+import llm_client
+import llm_usage
+import metrics
+import request_profile
 
 # Load environment variables
 load_dotenv()
 
 # Initialize Flask
 app = Flask(__name__)
+metrics.register_endpoint(app)
+request_profile.register(app)
+llm_usage.register_endpoint(app)
+export.register_endpoint(app)
+
+SERVICE = "brandmatch"
+LLAMA_MODEL = "meta-llama/Llama-3.1-8B-Instruct"
 
 # Load brand list
 BRAND_LIST_PATH = "brand_list.json"
 with open(BRAND_LIST_PATH, "r", encoding="utf-8") as f:
     brand_df = pd.read_json(f)
 
-# Hugging Face client
-client = InferenceClient(
-    model="meta-llama/Llama-3.1-8B-Instruct",
-    token=os.getenv("HF_TOKEN")
-)
-
-def call_llama(prompt, max_tokens=400, temperature=0.2):
+def call_llama(prompt, max_tokens=400, temperature=0.2, task='brand_match'):
+    if not llm_usage.check_budget(SERVICE, prompt):
+        return None
     try:
-        completion = client.text_generation(prompt=prompt, max_new_tokens=max_tokens, temperature=temperature)
-        return completion.strip()
+        llm = llm_client.for_task(SERVICE, task, LLAMA_MODEL)
+        response_text, completion = llm.complete_json(prompt, max_tokens, temperature, retries=1)
+        llm_usage.record(SERVICE, prompt, response_text, completion)
+        return response_text
     except Exception as e:
         return None
 
 def extract_best_brand_match(user_input, threshold=85):
     # Fuzzy match
     choices = brand_df["BRAND NAME"].tolist()
-    best_match, score = process.extractOne(user_input, choices)
+    with metrics.stage(SERVICE, 'fuzzy_match'):
+        best_match, score = process.extractOne(user_input, choices)
 
     if score >= threshold:
         match_row = brand_df[brand_df["BRAND NAME"] == best_match].iloc[0]
@@ -45,6 +55,7 @@ def extract_best_brand_match(user_input, threshold=85):
     return None
 
 @app.route('/match-brand', methods=['GET'])
+@llm_usage.tracked('match_brand')
 def match_brand():
     store_name = request.args.get("store")
 
@@ -56,6 +67,13 @@ def match_brand():
     result = extract_best_brand_match(store_name)
 
     if result:
+        export.export_records('brand_matches', [{
+            'store_query': store_name,
+            'matched_brand': result["brand_name"],
+            'brand_id': result["brand_id"],
+            'score': result["score"],
+            'source': 'fuzzy'
+        }])
         return jsonify({
             "success": True,
             "matched_brand": result["brand_name"],
@@ -78,10 +96,17 @@ Respond ONLY in this JSON format:
 """
     response = call_llama(prompt)
     try:
-        match_json = json.loads(response)
+        match_json = json_stream.extract_json(response) or {}
         match_name = match_json.get("match")
         if match_name and match_name != "NONE":
             match_row = brand_df[brand_df["BRAND NAME"] == match_name].iloc[0]
+            export.export_records('brand_matches', [{
+                'store_query': store_name,
+                'matched_brand': match_name,
+                'brand_id': match_row["BRAND ID"],
+                'score': None,
+                'source': 'llm'
+            }])
             return jsonify({
                 "success": True,
                 "matched_brand": match_name,
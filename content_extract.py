@@ -0,0 +1,209 @@
+"""Choose which text blocks of a page go into a fixed-size LLM window, instead of the first N characters"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+from bs4 import Comment
+
+BLOCK_TAGS = {
+    'p', 'li', 'td', 'th', 'dd', 'dt', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'address', 'blockquote',
+    'section', 'article', 'main', 'div', 'ul', 'ol', 'table', 'tr', 'form', 'figure', 'figcaption', 'body'
+}
+HEADING_TAGS = {'h1', 'h2', 'h3'}
+
+BOILERPLATE_HINTS = re.compile(
+    r'cookie|consent|gdpr|banner|newsletter|subscribe|popup|modal|breadcrumb|menu|navbar|social|share|promo',
+    re.IGNORECASE)
+CONTENT_HINTS = re.compile(r'store|shop|tenant|retailer|detail|content|main|article|info|hours|contact', re.IGNORECASE)
+BOILERPLATE_TEXT = re.compile(
+    r'\b(cookies?|accept all|privacy policy|terms of use|all rights reserved|sign up|newsletter)\b', re.IGNORECASE)
+DETAIL_TEXT = re.compile(
+    r'(\+?\d[\d\s().-]{7,}\d)|(\b\d{1,2}(:\d{2})?\s?(am|pm)\b)|(\b\d{1,2}:\d{2}\b)|(@[\w-]+\.\w+)'
+    r'|\b(mon|tue|wed|thu|fri|sat|sun|lun|mar|mer|jeu|ven|sam|dim|level|floor|unit|suite|niveau|local)\b',
+    re.IGNORECASE)
+
+# Blocks seen on this share of a site's pages are treated as site boilerplate
+SITE_BOILERPLATE_RATIO = 0.5
+SITE_MIN_PAGES = 3
+SHORT_BLOCK_WORDS = 6  # shorter blocks (field labels and values) are never site boilerplate
+MAIN_TAGS = {'main', 'article'}
+MAX_SITES = 1000
+MAX_BLOCKS_PER_SITE = 5000
+MAX_PAGES_PER_SITE = 5000
+
+
+class SiteBoilerplate:
+    """Counts, per site, how many distinct pages each block of text appeared on"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sites = OrderedDict()  # site -> {'pages': n, 'seen': OrderedDict(page), 'blocks': OrderedDict(hash -> count)}
+
+    def ratio(self, site, block_hash):
+        with self.lock:
+            entry = self.sites.get(site)
+            if not entry or entry['pages'] < SITE_MIN_PAGES:
+                return 0.0
+            return entry['blocks'].get(block_hash, 0) / entry['pages']
+
+    def record_page(self, site, page, block_hashes):
+        """Count a page's blocks once per (site, page): re-parsing the same URL must not make its content look shared"""
+        with self.lock:
+            entry = self.sites.pop(site, None) or {'pages': 0, 'seen': OrderedDict(), 'blocks': OrderedDict()}
+            self.sites[site] = entry
+            if len(self.sites) > MAX_SITES:
+                self.sites.popitem(last=False)
+            seen = entry['seen']
+            if page in seen:
+                seen.move_to_end(page)
+                return
+            seen[page] = None
+            while len(seen) > MAX_PAGES_PER_SITE:
+                seen.popitem(last=False)
+            entry['pages'] += 1
+            blocks = entry['blocks']
+            for block_hash in block_hashes:
+                blocks[block_hash] = blocks.pop(block_hash, 0) + 1
+            while len(blocks) > MAX_BLOCKS_PER_SITE:
+                blocks.popitem(last=False)
+
+
+site_boilerplate = SiteBoilerplate()
+
+
+def block_of(node):
+    parent = node.parent
+    while parent is not None and parent.name not in BLOCK_TAGS:
+        parent = parent.parent
+    return parent
+
+
+def in_link(node, block):
+    parent = node.parent
+    while parent is not None and parent is not block:
+        if parent.name == 'a':
+            return True
+        parent = parent.parent
+    return False
+
+
+def attribute_hints(element):
+    hints = []
+    while element is not None and element.name not in (None, '[document]', 'body'):
+        hints.extend(element.get('class') or [])
+        hints.append(element.get('id') or '')
+        hints.append(element.get('role') or '')
+        element = element.parent
+    return ' '.join(hints)
+
+
+def collect_blocks(soup):
+    """Group the page's strings by their nearest block element, in document order"""
+    blocks = OrderedDict()
+    for node in soup.find_all(string=True):
+        if isinstance(node, Comment):
+            continue
+        text = node.strip()
+        if not text:
+            continue
+        block = block_of(node)
+        if block is None:
+            continue
+        entry = blocks.get(id(block))
+        if entry is None:
+            entry = blocks[id(block)] = {'element': block, 'parts': [], 'link_chars': 0}
+        entry['parts'].append(text)
+        if in_link(node, block):
+            entry['link_chars'] += len(text)
+
+    result = []
+    for entry in blocks.values():
+        text = ' '.join(entry['parts'])
+        result.append({
+            'element': entry['element'],
+            'text': text,
+            'link_density': entry['link_chars'] / len(text),
+            'hash': hashlib.md5(text.lower().encode()).hexdigest(),
+        })
+    return result
+
+
+def score_block(block):
+    text = block['text']
+    words = len(text.split())
+    score = min(words, 80) / 10  # text density, saturating so one huge block doesn't win everything
+    score -= block['link_density'] * 6
+
+    hints = attribute_hints(block['element'])
+    if BOILERPLATE_HINTS.search(hints):
+        score -= 8
+    if CONTENT_HINTS.search(hints):
+        score += 2
+    if BOILERPLATE_TEXT.search(text):
+        score -= 4
+    score += min(len(DETAIL_TEXT.findall(text)), 4) * 1.5
+    if block['element'].name in HEADING_TAGS:
+        score += 4
+
+    return score
+
+
+def in_main(element):
+    while element is not None:
+        if element.name in MAIN_TAGS or element.get('role') == 'main':
+            return True
+        element = element.parent
+    return False
+
+
+def site_penalty(block, site):
+    """Penalty for a block repeated across the site's pages. Only long blocks that look like page chrome
+    (boilerplate hints, or outside the main container) qualify: repeated labels ("Phone", "Hours")
+    and short values ("Level 2") are store fields, not boilerplate"""
+    text = block['text']
+    if len(text.split()) < SHORT_BLOCK_WORDS or DETAIL_TEXT.search(text):
+        return 0
+    element = block['element']
+    if not BOILERPLATE_HINTS.search(attribute_hints(element)) and in_main(element):
+        return 0
+    ratio = site_boilerplate.ratio(site, block['hash'])
+    return 10 * ratio if ratio >= SITE_BOILERPLATE_RATIO else 0
+
+
+def select_main_content(soup, budget, site=None, page=None):
+    """
+    Text of the highest-scoring blocks that fit in budget characters, in document order.
+    Blocks scored as boilerplate are dropped even when the whole page would fit.
+    site and page (e.g. the netloc and the URL) enable learning boilerplate shared across pages of the same site,
+    which is used only to make room on pages over budget.
+    """
+    blocks = collect_blocks(soup)
+    for index, block in enumerate(blocks):
+        block['index'] = index
+        block['score'] = score_block(block)
+
+    kept = [block for block in blocks if block['score'] > -3]
+    if site and sum(len(block['text']) + 1 for block in kept) > budget:
+        for block in kept:
+            block['score'] -= site_penalty(block, site)
+        kept = [block for block in kept if block['score'] > -3]
+    if site and page:
+        site_boilerplate.record_page(site, page, {block['hash'] for block in blocks})
+
+    if sum(len(block['text']) + 1 for block in kept) > budget:
+        chosen = []
+        used = 0
+        for block in sorted(kept, key=lambda b: b['score'], reverse=True):
+            if block['score'] <= 0 and chosen:
+                break
+            if used + len(block['text']) + 1 > budget:
+                continue
+            chosen.append(block)
+            used += len(block['text']) + 1
+        kept = sorted(chosen, key=lambda b: b['index']) or kept
+
+    text = ' '.join(block['text'] for block in kept)
+    if len(text) > budget:
+        text = text[:budget] + "..."
+    return text
@@ -3,27 +3,18 @@ import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
 import re
+from concurrent.futures import ThreadPoolExecutor
 
-app = Flask(__name__)
+import http_fetch
+import metrics
+import request_profile
+import site_profile
 
-def discover_site_urls(homepage):
-    parsed = urlparse(homepage)
-    base = f"{parsed.scheme}://{parsed.netloc}"
-    urls = set()
-
-    # Try robots.txt
-    try:
-        robots = requests.get(urljoin(base, '/robots.txt')).text
-        urls.update(re.findall(r'(https?://[^\s]+)', robots))
-    except:
-        pass
+app = Flask(__name__)
+metrics.register_endpoint(app)
+request_profile.register(app)
 
-    # Try sitemap.xml
-    #try:
-    #    sitemap = requests.get(urljoin(base, '/sitemap.xml')).text
-    #    urls.update(re.findall(r'<loc>(.*?)</loc>', sitemap))
-    #except:
-    #    pass
+session = requests.Session()
 
 sitemap_paths = [
     "/sitemap.xml",
@@ -39,19 +30,84 @@ sitemap_paths = [
     "/sitemap/sitemap-index.xml",
     "/sitemap_index/sitemap.xml",
 ]
+SITEMAP_PROBE_TIMEOUT = 5
+SITEMAP_PROBE_BYTES = 64 * 1024  # enough to see a <loc>; only the chosen sitemap is downloaded in full
+
+def probe_sitemap(base, path, sniff=False):
+    """Return (body, complete) if base + path is a sitemap, else None.
+    sniff reads only the first SITEMAP_PROBE_BYTES, so complete may be False"""
+    response = http_fetch.fetch(session.get, urljoin(base, path),
+                                max_bytes=SITEMAP_PROBE_BYTES if sniff else http_fetch.SITEMAP_MAX_BYTES,
+                                allowed_types=http_fetch.SITEMAP_TYPES, refuse_oversized=not sniff,
+                                timeout=SITEMAP_PROBE_TIMEOUT)
+    if response.status_code != 200:
+        return None
+    body = http_fetch.gunzip_capped(response.content)
+    text = response.text if body is response.content else body.decode('utf-8', errors='replace')
+    return (text, not response.truncated) if "<loc>" in text else None
+
+def find_sitemap(base):
+    """Probe all sitemap_paths concurrently and return (path, body) of the first valid one in sitemap_paths order"""
+    known_path = site_profile.get_profile(base).get('sitemap_path')
 
-for path in sitemap_paths:
+    # Go straight to the path that worked before, as recorded in the site profile
+    if known_path:
+        try:
+            found = probe_sitemap(base, known_path)
+            if found:
+                return known_path, found[0]
+        except Exception as e:
+            print(f"Error fetching {known_path}: {e}")
+        site_profile.update_profile(base, sitemap_path=None)
+
+    # Probes only read the start of each body; /sitemap.xml beats /sitemap-en.xml however fast the latter answers
+    executor = ThreadPoolExecutor(max_workers=len(sitemap_paths))
+    futures = [executor.submit(probe_sitemap, base, path, True) for path in sitemap_paths]
     try:
-        response = session.get(urljoin(base, path), timeout=5)
-        if response.status_code == 200 and "<loc>" in response.text:
-            urls.update(re.findall(r"<loc>(.*?)</loc>", response.text))
-    except Exception as e:
-        print(f"Error fetching {path}: {e}")
+        for path, future in zip(sitemap_paths, futures):
+            try:
+                found = future.result()
+            except Exception as e:
+                print(f"Error fetching {path}: {e}")
+                continue
+            if not found:
+                continue
+            body, complete = found
+            if not complete:
+                try:
+                    body = (probe_sitemap(base, path) or found)[0]
+                except Exception as e:
+                    print(f"Error fetching {path}: {e}")
+            site_profile.update_profile(base, sitemap_path=path)
+            return path, body
+    finally:
+        # Lower-priority probes still running stop after SITEMAP_PROBE_BYTES
+        executor.shutdown(wait=False, cancel_futures=True)
+    return None, None
+
+def discover_site_urls(homepage):
+    parsed = urlparse(homepage)
+    base = f"{parsed.scheme}://{parsed.netloc}"
+    urls = set()
+
+    # Try robots.txt
+    try:
+        robots = http_fetch.fetch(session.get, urljoin(base, '/robots.txt'), max_bytes=512 * 1024,
+                                  timeout=SITEMAP_PROBE_TIMEOUT).text
+        urls.update(re.findall(r'(https?://[^\s]+)', robots))
+    except:
+        pass
+
+    # Try sitemap locations
+    path, sitemap = find_sitemap(base)
+    if sitemap:
+        print(f"Using sitemap {path} for {parsed.netloc}")
+        urls.update(re.findall(r"<loc>(.*?)</loc>", sitemap))
 
-    
     # Try homepage crawl
     try:
-        soup = BeautifulSoup(requests.get(homepage).text, 'html.parser')
+        homepage_response = http_fetch.fetch(session.get, homepage, allowed_types=http_fetch.HTML_TYPES, timeout=10)
+        soup = BeautifulSoup(homepage_response.text, 'html.parser')
         for link in soup.find_all('a', href=True):
             full_url = urljoin(base, link['href'])
             if parsed.netloc in urlparse(full_url).netloc:
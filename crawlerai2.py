@@ -1,12 +1,12 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
 import re
 import json
 import os
-from huggingface_hub import InferenceClient
 from dotenv import load_dotenv
+import threading
 import time
 from datetime import datetime
 
@@ -14,18 +14,54 @@ import ssl
 from requests.adapters import HTTPAdapter
 from urllib3.poolmanager import PoolManager
 
+import content_extract
+import directory_extract
+import export
+import http_fetch
+import json_stream
+import llm_usage
+import locale_groups
+import metrics
+import request_profile
+import site_profile
+import url_classifier
+import url_codec
+from url_index import URLIndex
+import llm_client
+from llm_coordination import MicroBatcher, SingleFlight
+
 load_dotenv()
 app = Flask(__name__)
+metrics.register_endpoint(app)
+request_profile.register(app)
+llm_usage.register_endpoint(app)
+export.register_endpoint(app)
+url_classifier.register_endpoint(app)
+
+SERVICE = "crawlerai2"
 
-client = InferenceClient(
-    provider="fireworks-ai",
-    api_key=os.environ.get("HF_TOKEN"),
-)
+LLAMA_MODEL = "meta-llama/Llama-4-Maverick-17B-128E-Instruct"  # remote default; LLM_ROUTES can move tasks
 
 # Rate limiting globals
 last_request_time = 0
 min_request_interval = 1.0  # 1 second between requests
 
+# parse_shop micro-batching: pack up to PARSE_SHOP_BATCH_SIZE concurrent extractions in one prompt
+PARSE_SHOP_BATCH = os.environ.get("PARSE_SHOP_BATCH", "").lower() in ("1", "true", "yes")
+PARSE_SHOP_BATCH_SIZE = int(os.environ.get("PARSE_SHOP_BATCH_SIZE", 4))
+PARSE_SHOP_BATCH_WAIT = float(os.environ.get("PARSE_SHOP_BATCH_WAIT", 0.05))
+
+# NDJSON streaming: flush a chunk when it is full or has waited this long
+STREAM_CHUNK_SIZE = 500
+STREAM_FLUSH_INTERVAL = 1.0
+
+# Crawl cache: homepage -> (timestamp, URLIndex), so /filter-links reuses the crawl /discover-roots just did
+CRAWL_CACHE_TTL = int(os.environ.get("CRAWL_CACHE_TTL", 3600))
+CRAWL_CACHE_MAX_SITES = int(os.environ.get("CRAWL_CACHE_MAX_SITES", 4))
+CRAWL_CACHE_MAX_URLS = int(os.environ.get("CRAWL_CACHE_MAX_URLS", 200000))  # across sites, per worker
+crawl_cache = {}  # key -> (timestamp, urls, URLIndex or None until /filter-links needs it)
+crawl_cache_lock = threading.Lock()
+
 class TLSAdapter(HTTPAdapter):
     def init_poolmanager(self, *args, **kwargs):
         context = ssl.create_default_context()
@@ -47,39 +83,39 @@ def rate_limit():
     last_request_time = time.time()
 
 def extract_json_from_response(response_text):
-    """Extract JSON from Llama response, handling markdown code blocks"""
-    
-    # Remove markdown code blocks if present
-    response_text = response_text.strip()
+    """Extract JSON from Llama response, handling markdown code blocks and prose around the object"""
     
-    # Remove ```json and ``` markers
-    if response_text.startswith('```json'):
-        response_text = response_text[7:]  # Remove ```json
-    if response_text.startswith('```'):
-        response_text = response_text[3:]   # Remove ```
-    if response_text.endswith('```'):
-        response_text = response_text[:-3]  # Remove trailing ```
-    
-    response_text = response_text.strip()
-    
-    # Find JSON object bounds
-    json_start = response_text.find('{')
-    json_end = response_text.rfind('}') + 1
-    
-    if json_start >= 0 and json_end > json_start:
-        json_text = response_text[json_start:json_end]
-        try:
-            return json.loads(json_text)
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing failed: {e}")
-            print(f"Attempted to parse: {json_text[:200]}...")
-            return None
+    # First complete JSON object; fences and braces in any trailing text don't matter
+    with metrics.stage(SERVICE, 'json_extract'):
+        result = json_stream.extract_json(response_text)
+    if result is not None:
+        return result
     
-    print("No valid JSON found in response")
+    print(f"No valid JSON found in response: {response_text[:200]}...")
     return None
 
 session = requests.Session()
 session.mount('https://', TLSAdapter())
+strict_session = requests.Session()
+
+def profiled_get(url, max_bytes=http_fetch.MAX_BODY_BYTES, allowed_types=None, **kwargs):
+    """
+    Size-capped streaming GET (see http_fetch.fetch) using the TLS mode from the domain's profile,
+    learning it on first contact
+    """
+    tls_mode = site_profile.get_profile(url).get('tls_mode')
+    if tls_mode == 'relaxed' or not url.startswith('https://'):
+        return http_fetch.fetch(session.get, url, max_bytes, allowed_types, **kwargs)
+    try:
+        response = http_fetch.fetch(strict_session.get, url, max_bytes, allowed_types, **kwargs)
+    except requests.exceptions.SSLError:
+        # Handshake needs the relaxed TLSAdapter; remember so we skip the failing attempt next time
+        response = http_fetch.fetch(session.get, url, max_bytes, allowed_types, **kwargs)
+        site_profile.update_profile(url, tls_mode='relaxed')
+        return response
+    if tls_mode is None:
+        site_profile.update_profile(url, tls_mode='default')
+    return response
 
 def safe_request(url, timeout=10, retries=2):
     """Make HTTP request with retry logic, return None on failure"""
@@ -88,122 +124,291 @@ def safe_request(url, timeout=10, retries=2):
         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36',
         'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
         'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate',
+        'Accept-Encoding': http_fetch.ACCEPT_ENCODING,
         'Connection': 'keep-alive',
     }
 
     for attempt in range(retries):
         try:
-            response = session.get(url, timeout=timeout, headers=headers)
+            with metrics.stage(SERVICE, 'fetch'):
+                response = profiled_get(url, allowed_types=http_fetch.HTML_TYPES, timeout=timeout, headers=headers)
+            metrics.record_fetch(SERVICE, response)
             if response.status_code == 200:
                 return response
             else:
                 print(f"HTTP {response.status_code} for {url}")
+        except http_fetch.FetchRefused as e:
+            print(f"❌ Not downloading {url}: {e}")
+            return None
         except requests.exceptions.RequestException as e:
             print(f"Request attempt {attempt + 1} failed for {url}: {str(e)[:100]}...")
             if attempt < retries - 1:
                 wait_time = (attempt + 1) * 3  # 3, 6 seconds
                 print(f"Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
+                metrics.RETRIES.inc(SERVICE, 'http')
+                metrics.timed_sleep(SERVICE, wait_time)
 
     print(f"❌ All attempts failed for {url} - returning None")
     return None
 
-def call_llama(prompt, max_tokens=1000, temperature=0.1, retries=3):
-    """Centralized Llama API call method with retry logic"""
-    for attempt in range(retries):
-        try:
-            completion = client.chat.completions.create(
-                model="meta-llama/Llama-4-Maverick-17B-128E-Instruct",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
-            
-            response_text = completion.choices[0].message.content.strip()
-            return {
-                "success": True,
-                "response": response_text,
-                "error": None
-            }
-            
-        except Exception as e:
-            error_msg = str(e)
-            print(f"Llama call attempt {attempt + 1} failed: {error_msg}")
-            
-            if attempt < retries - 1:
-                wait_time = (attempt + 1) * 2  # 2, 4, 6 seconds
-                print(f"Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
-            else:
-                return {
-                    "success": False,
-                    "response": None,
-                    "error": error_msg
-                }
+llm_flight = SingleFlight()
 
-def crawl_website(homepage):
-    """Crawl website and get all URLs - PROPERLY"""
+def budget_exceeded_result():
+    return {
+        "success": False,
+        "response": None,
+        "error": "LLM token budget exceeded",
+        "budget_exceeded": True
+    }
+
+def call_llama(prompt, max_tokens=1000, temperature=0.1, retries=3, task='llama', stream_json=False):
+    """Centralized Llama API call method with retry logic; identical concurrent calls share one request.
+    task selects the backend and model (see llm_backend.LLM_ROUTES). stream_json stops generation once the
+    answer's JSON object is complete, for prompts that answer with one"""
+    if not llm_usage.check_budget(SERVICE, prompt):
+        return budget_exceeded_result()
+
+    result, shared = llm_flight.do(
+        (task, prompt, max_tokens, temperature, stream_json),
+        lambda: _call_llama(prompt, max_tokens, temperature, retries, task, stream_json)
+    )
+    if shared:
+        metrics.LLM_CALLS.inc(SERVICE, 'deduplicated')
+    return dict(result)
+
+def _call_llama(prompt, max_tokens, temperature, retries, task, stream_json):
+    try:
+        llm = llm_client.for_task(SERVICE, task, LLAMA_MODEL)
+        complete = llm.complete_json if stream_json else llm.complete
+        response_text, completion = complete(prompt, max_tokens, temperature, retries)
+    except Exception as e:
+        error_msg = str(e)
+        print(f"Llama call failed: {error_msg}")
+        return {
+            "success": False,
+            "response": None,
+            "error": error_msg
+        }
+
+    llm_usage.record(SERVICE, prompt, response_text, completion)
+    return {
+        "success": True,
+        "response": response_text,
+        "error": None
+    }
+
+def iter_website_urls(homepage, alternates=None):
+    """Yield each unique URL of a website as soon as it is discovered.
+    hreflang alternates found in sitemaps and on the homepage are added to the alternates dict, if given"""
     parsed = urlparse(homepage)
     base = f"{parsed.scheme}://{parsed.netloc}"
-    urls = set()
-    
-    print(f"Crawling {base}...")
-    
-    # Try robots.txt for sitemaps
-    try:
-        robots = requests.get(urljoin(base, '/robots.txt'), timeout=10).text
-        sitemap_refs = re.findall(r'sitemap:\s*(https?://[^\s]+)', robots, re.IGNORECASE)
-        for sitemap_url in sitemap_refs:
-            urls.update(extract_sitemap_urls(sitemap_url))
-    except:
-        pass
+    seen = set()
+    known_sitemaps = site_profile.get_profile(homepage).get('sitemaps') or []
+    working_sitemaps = []
+
+    def new_urls(found):
+        for url in found:
+            if url not in seen:
+                seen.add(url)
+                yield url
+
+    def from_sitemap(sitemap_url):
+        found = 0
+        for url in iter_sitemap_urls(sitemap_url, alternates):
+            found += 1
+            yield url
+        if found and sitemap_url not in working_sitemaps:
+            working_sitemaps.append(sitemap_url)
+
+    # Go straight to the sitemaps that worked last time
+    for sitemap_url in known_sitemaps:
+        try:
+            yield from new_urls(from_sitemap(sitemap_url))
+        except Exception:  # not bare: the stream consumer may close us (GeneratorExit)
+            pass
 
-    # Try default sitemap.xml
-    try:
-        urls.update(extract_sitemap_urls(urljoin(base, '/sitemap.xml')))
-    except:
-        pass
-        
-    # Try sitemap index
-    try:
-        urls.update(extract_sitemap_urls(urljoin(base, '/sitemap_index.xml')))
-    except:
-        pass
+    if not working_sitemaps:
+        # Try robots.txt for sitemaps
+        try:
+            with metrics.stage(SERVICE, 'fetch'):
+                robots_response = profiled_get(urljoin(base, '/robots.txt'), max_bytes=512 * 1024, timeout=10)
+            metrics.record_fetch(SERVICE, robots_response)
+            robots = robots_response.text
+            sitemap_refs = re.findall(r'sitemap:\s*(https?://[^\s]+)', robots, re.IGNORECASE)
+            for sitemap_url in sitemap_refs:
+                yield from new_urls(from_sitemap(sitemap_url))
+        except Exception:
+            pass
+
+        # Try default sitemap.xml
+        try:
+            yield from new_urls(from_sitemap(urljoin(base, '/sitemap.xml')))
+        except Exception:
+            pass
+
+        # Try sitemap index
+        try:
+            yield from new_urls(from_sitemap(urljoin(base, '/sitemap_index.xml')))
+        except Exception:
+            pass
+
+    if working_sitemaps != known_sitemaps:
+        site_profile.update_profile(homepage, sitemaps=working_sitemaps or None)
 
     # Try homepage
     try:
-        soup = BeautifulSoup(requests.get(homepage, timeout=10).text, 'html.parser')
+        with metrics.stage(SERVICE, 'fetch'):
+            homepage_response = profiled_get(homepage, allowed_types=http_fetch.HTML_TYPES, timeout=10)
+        metrics.record_fetch(SERVICE, homepage_response)
+        with metrics.stage(SERVICE, 'html_parse'):
+            soup = BeautifulSoup(homepage_response.text, 'html.parser')
+        if alternates is not None:
+            locale_groups.add_alternates(alternates, locale_groups.html_alternates(soup, homepage_response.url))
+        homepage_links = []
         for link in soup.find_all('a', href=True):
             full_url = urljoin(base, link['href'])
             if parsed.netloc in urlparse(full_url).netloc:
-                urls.add(full_url)
-    except:
+                homepage_links.append(full_url)
+        yield from new_urls(homepage_links)
+    except Exception:
         pass
 
+def crawl_website(homepage, alternates=None):
+    """Crawl website and get all URLs - PROPERLY"""
+    print(f"Crawling {homepage}...")
+    urls = sorted(set(iter_website_urls(homepage, alternates)))
     print(f"Found {len(urls)} total URLs")
-    return sorted(urls)
+    if export.enabled():
+        export.export_records('crawl_urls', [{'website': homepage, 'url': url} for url in urls])
+    if urls and len(urls) <= CRAWL_CACHE_MAX_URLS:
+        with crawl_cache_lock:
+            crawl_cache[crawl_cache_key(homepage)] = (time.time(), urls, None)
+            while (len(crawl_cache) > CRAWL_CACHE_MAX_SITES
+                   or sum(len(entry[1]) for entry in crawl_cache.values()) > CRAWL_CACHE_MAX_URLS):
+                del crawl_cache[min(crawl_cache, key=lambda k: crawl_cache[k][0])]
+    return urls
 
-def extract_sitemap_urls(sitemap_url):
-    """Extract URLs from sitemap"""
-    urls = set()
+def crawl_cache_key(homepage):
+    return homepage.strip().rstrip('/').lower()
+
+def cached_crawl(homepage, refresh=False):
+    """URLIndex of the site's last crawl within CRAWL_CACHE_TTL, crawling now if there is none.
+    Returns (index, cache_hit)"""
+    key = crawl_cache_key(homepage)
+    with crawl_cache_lock:
+        entry = crawl_cache.get(key)
+    hit = bool(entry and not refresh and time.time() - entry[0] < CRAWL_CACHE_TTL)
+    metrics.record_cache(SERVICE, 'crawl', hit)
+    if not hit:
+        urls = crawl_website(homepage)
+        with crawl_cache_lock:
+            entry = crawl_cache.get(key)
+        if not entry:  # too large to cache
+            with metrics.stage(SERVICE, 'url_index'):
+                return URLIndex(urls), False
+    timestamp, urls, index = entry
+    if index is None:
+        # Indexed on first use, so /discover and /crawl-only don't pay for (or hold) an index
+        with metrics.stage(SERVICE, 'url_index'):
+            index = URLIndex(urls)
+        with crawl_cache_lock:
+            if crawl_cache.get(key) is entry:
+                crawl_cache[key] = (timestamp, urls, index)
+    return index, hit
+
+def iter_sitemap_urls(sitemap_url, alternates=None):
+    """Yield URLs from sitemap, following nested sitemap indexes; hreflang groups go into alternates"""
     try:
-        response = requests.get(sitemap_url, timeout=10)
-        if response.status_code == 200:
-            content = response.text
-            if '<sitemapindex' in content:
-                # Sitemap index - get nested sitemaps
-                nested = re.findall(r'<loc>(.*?)</loc>', content)
-                for nested_url in nested:
-                    urls.update(extract_sitemap_urls(nested_url))
-            else:
-                # Regular sitemap - get page URLs
-                urls.update(re.findall(r'<loc>(.*?)</loc>', content))
+        with metrics.stage(SERVICE, 'fetch'):
+            response = profiled_get(sitemap_url, max_bytes=http_fetch.SITEMAP_MAX_BYTES,
+                                    allowed_types=http_fetch.SITEMAP_TYPES, timeout=10)
+        metrics.record_fetch(SERVICE, response)
+        if response.status_code != 200:
+            return
+        # sitemap.xml.gz files arrive as gzip bodies, not Content-Encoding
+        body = http_fetch.gunzip_capped(response.content)
+        content = response.text if body is response.content else body.decode('utf-8', errors='replace')
+        del body
     except:
-        pass
-    return urls
+        return
+
+    is_index = '<sitemapindex' in content
+    with metrics.stage(SERVICE, 'sitemap_parse'):
+        locs = re.findall(r'<loc>(.*?)</loc>', content)
+        if alternates is not None and not is_index:
+            for group in locale_groups.sitemap_alternates(content):
+                locale_groups.add_alternates(alternates, group)
+    del content, response
+    if is_index:
+        # Sitemap index - get nested sitemaps
+        for nested_url in locs:
+            yield from iter_sitemap_urls(nested_url, alternates)
+    else:
+        # Regular sitemap - get page URLs
+        yield from locs
+
+def extract_sitemap_urls(sitemap_url):
+    """Extract URLs from sitemap"""
+    return set(iter_sitemap_urls(sitemap_url))
+
+def stream_ndjson(records):
+    """Wrap a generator of dicts into a streaming NDJSON response"""
+    def generate():
+        for record in records:
+            yield json.dumps(record) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def iter_url_chunks(urls):
+    """Group an URL stream into lists, flushed by size or by STREAM_FLUSH_INTERVAL"""
+    chunk = []
+    last_flush = time.time()
+    for url in urls:
+        chunk.append(url)
+        if len(chunk) >= STREAM_CHUNK_SIZE or time.time() - last_flush >= STREAM_FLUSH_INTERVAL:
+            yield chunk
+            chunk = []
+            last_flush = time.time()
+    if chunk:
+        yield chunk
+
+def wants_locale_collapse():
+    return request.args.get('collapse_locales', '1').lower() not in ('0', 'false', 'no')
+
+def collapse_locales(urls, alternates):
+    """One URL per page across languages: (representatives, {representative: {language: url}})"""
+    with metrics.stage(SERVICE, 'locale_grouping'):
+        groups = locale_groups.group_urls(urls, alternates)
+    print(f"Collapsed {len(urls)} URLs to {len(groups)} locale groups")
+    return list(groups), groups
+
+def wants_stream():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes', 'ndjson')
+
+DIRECTORY_SEGMENTS = [
+    'stores', 'store-directory', 'directory', 'shops', 'shopping', 'brands', 'members',
+    'tiendas', 'directorio', 'marcas', 'miembros', 'boutiques', 'magasins', 'marques', 'membres',
+    'negozi', 'lojas', 'membros'
+]
+
+def find_directory_pages_heuristic(urls):
+    """Fallback without Llama: URLs whose last path segment is a store-listing word"""
+    matches = []
+    for url in urls:
+        path_segments = [seg for seg in urlparse(url).path.lower().split('/') if seg]
+        if path_segments and path_segments[-1] in DIRECTORY_SEGMENTS:
+            matches.append(url)
+    return sorted(set(matches))
 
 def find_directory_pages(urls):
+    """Directory pages the local URL classifier is sure of, plus Llama's picks among the URLs it is unsure about"""
+    confident, uncertain = url_classifier.triage(SERVICE, 'directory', urls)
+    if len(uncertain) < len(urls):
+        print(f"URL classifier: {len(confident)} directory pages, {len(uncertain)} URLs left for Llama")
+    if not uncertain:
+        return sorted(confident)
+    return sorted(confident) + [url for url in find_directory_pages_llama(uncertain) if url not in confident]
+
+def find_directory_pages_llama(urls):
     """Find store directory pages using pure Llama approach with chunking"""
     
     print(f"Looking for directory pages in {len(urls)} URLs using Llama...")
@@ -219,6 +424,8 @@ def find_directory_pages(urls):
         
         print(f"Processing chunk {chunk_num}/{total_chunks} ({len(chunk)} URLs)...")
         
+        # Shared host/path prefixes are written once; the model answers with line numbers
+        listed, listing = url_codec.encode_urls(chunk)
         prompt = f"""RESPOND WITH ONLY JSON. NO EXPLANATIONS.
 
             Find TOP 10 URLs that are likely to be STORE, MEMBERS, BRANDS or SHOPS listing pages (list multiple stores/shops).
@@ -229,16 +436,25 @@ def find_directory_pages(urls):
 
             You should be multilingual in your analysis 
 
-            URLs:
-            {chr(10).join(f"{j+1}. {url}" for j, url in enumerate(chunk))}
+            URLs, as {{PREFIX}} labels followed by the rest of the URL:
+            {listing}
+
+            Answer with the line numbers of the URLs.
 
             JSON ONLY:
-            {{"directory_candidates": ["url1", "url2", "url3", "url4", "url5", "url6", "url7", "url8", "url9", "url10"]}}"""
+            {{"directory_candidates": [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]}}"""
 
         try:
             # Use centralized Llama call
-            llama_result = call_llama(prompt, max_tokens=500, temperature=0.0)
+            llama_result = call_llama(prompt, max_tokens=500, temperature=0.0,
+                                      task='directory_candidates', stream_json=True)
             
+            if llama_result.get("budget_exceeded"):
+                # Out of tokens: pattern-match the chunks we could not send
+                print(f"  Token budget exceeded, falling back to URL patterns from chunk {chunk_num} on")
+                all_candidates.extend(find_directory_pages_heuristic(urls[i:]))
+                break
+
             if not llama_result["success"]:
                 print(f"  Chunk {chunk_num} failed: {llama_result['error']}")
                 continue
@@ -247,28 +463,27 @@ def find_directory_pages(urls):
             print(f"  Llama response: {response[:100]}...")
             
             # Extract JSON
-            json_start = response.find('{')
-            json_end = response.rfind('}') + 1
+            with metrics.stage(SERVICE, 'json_extract'):
+                result = json_stream.extract_json(response)
             
-            if json_start >= 0 and json_end > json_start:
-                json_text = response[json_start:json_end]
-                result = json.loads(json_text)
-                chunk_candidates = result.get("directory_candidates", [])
+            if isinstance(result, dict):
+                chunk_answer = result.get("directory_candidates", [])
+                
+                # Line numbers map back to exact URLs from this chunk
+                valid_candidates = url_codec.decode_indices(chunk_answer, listed)
                 
                 print(f"  Llama selected from chunk {chunk_num}:")
-                for j, candidate in enumerate(chunk_candidates):
+                for j, candidate in enumerate(valid_candidates):
                     print(f"    {j+1}. {candidate}")
                 
-                # Validate URLs exist in original chunk
-                valid_candidates = [url for url in chunk_candidates if url in chunk]
-                invalid_candidates = [url for url in chunk_candidates if url not in chunk]
-                
-                if invalid_candidates:
-                    print(f"  WARNING: Llama hallucinated {len(invalid_candidates)} URLs:")
-                    for invalid in invalid_candidates:
-                        print(f"    FAKE: {invalid}")
+                invalid_count = len(chunk_answer) - len(valid_candidates) if isinstance(chunk_answer, list) else 0
+                if invalid_count:
+                    print(f"  WARNING: Llama answered {invalid_count} line numbers not in the chunk (or repeated)")
                 
                 all_candidates.extend(valid_candidates)
+                # The model only lists its top 10, so only a small sample of the rest is logged as noise
+                url_classifier.record_verdicts('directory', [
+                    (url, 'noise') for url in url_classifier.sample_noise(chunk, set(valid_candidates))])
                 print(f"  Added {len(valid_candidates)} valid candidates from chunk {chunk_num}")
             else:
                 print(f"  No valid JSON in chunk {chunk_num}")
@@ -284,19 +499,25 @@ def find_directory_pages(urls):
     # Step 2: Send all candidates to Llama for final selection
     print(f"\nStep 2: Final Llama analysis of {len(all_candidates)} candidates...")
     print("all_candidates: ", all_candidates)
+    listed, listing = url_codec.encode_urls(all_candidates)
     final_prompt = f"""RESPOND WITH ONLY JSON. NO EXPLANATIONS.
 
 Select ONLY store/member/shops listing pages. EXCLUDE news, events, blogs.
+URLs are {{PREFIX}} labels followed by the rest of the URL. Answer with line numbers.
 
-{chr(10).join(f"{i+1}. {url}" for i, url in enumerate(all_candidates))}
+{listing}
 
 JSON ONLY:
-{{"final_directories": ["url1", "url2"]}}"""
+{{"final_directories": [1, 2]}}"""
 
     try:
         # Use centralized Llama call
-        llama_result = call_llama(final_prompt, max_tokens=800, temperature=0.0)
+        llama_result = call_llama(final_prompt, max_tokens=800, temperature=0.0,
+                                  task='directory_final', stream_json=True)
         
+        if llama_result.get("budget_exceeded"):
+            return find_directory_pages_heuristic(all_candidates) or sorted(set(all_candidates))
+
         if not llama_result["success"]:
             print(f"Final Llama call failed: {llama_result['error']}")
             return []
@@ -305,19 +526,19 @@ JSON ONLY:
         print(f"Final Llama response: {response[:200]}...")
         
         # Extract JSON
-        json_start = response.find('{')
-        json_end = response.rfind('}') + 1
+        with metrics.stage(SERVICE, 'json_extract'):
+            result = json_stream.extract_json(response)
         
-        if json_start >= 0 and json_end > json_start:
-            json_text = response[json_start:json_end]
-            result = json.loads(json_text)
-            final_directories = result.get("final_directories", [])
+        if isinstance(result, dict):
+            final_directories = url_codec.decode_indices(result.get("final_directories", []), listed)
             
             print(f"\nLlama final selection:")
             for i, directory in enumerate(final_directories):
                 print(f"  {i+1}. {directory}")
             
             print(f"\nFinal result: {len(final_directories)} directory pages found")
+            url_classifier.record_verdicts('directory', [
+                (url, 'directory' if url in final_directories else 'noise') for url in dict.fromkeys(all_candidates)])
             
             return final_directories
         else:
@@ -381,89 +602,114 @@ def find_store_roots(urls):
     for i, root in enumerate(sorted(potential_roots)):
         print(f"  {i+1}. {root}")
     
+    # The local URL classifier settles the roots it is sure of; Llama validates the rest
+    confident, uncertain = url_classifier.triage(SERVICE, 'store_root', sorted(potential_roots))
+    if len(uncertain) < len(potential_roots):
+        print(f"URL classifier: {len(confident)} roots, {len(uncertain)} left for Llama")
+        if not uncertain:
+            return confident
+
     # Use Llama to validate and refine the roots
-    if potential_roots:
-        roots_list = sorted(potential_roots)
+    if uncertain:
+        listed, listing = url_codec.encode_urls(uncertain)
         
         prompt = f"""RESPOND WITH ONLY JSON. NO EXPLANATIONS.
 
             These are potential store root URLs where individual store pages are built from.
             Select the ones that are definitely ROOT URLs for stores/shops/brands.
 
-            Potential roots:
-            {chr(10).join(f"{i+1}. {url}" for i, url in enumerate(roots_list))}
+            Potential roots, as {{PREFIX}} labels followed by the rest of the URL:
+            {listing}
+
+            Answer with the line numbers of the roots.
 
             JSON ONLY:
-            {{"store_roots": ["url1", "url2", "url3"]}}"""
+            {{"store_roots": [1, 2, 3]}}"""
 
-        llama_result = call_llama(prompt, max_tokens=400, temperature=0.0)
+        llama_result = call_llama(prompt, max_tokens=400, temperature=0.0, task='store_roots', stream_json=True)
         
         if llama_result["success"]:
             try:
                 response = llama_result["response"]
-                json_start = response.find('{')
-                json_end = response.rfind('}') + 1
+                with metrics.stage(SERVICE, 'json_extract'):
+                    result = json_stream.extract_json(response)
                 
-                if json_start >= 0 and json_end > json_start:
-                    json_text = response[json_start:json_end]
-                    result = json.loads(json_text)
-                    validated_roots = result.get("store_roots", [])
+                if isinstance(result, dict):
+                    validated_roots = url_codec.decode_indices(result.get("store_roots", []), listed)
                     
                     print(f"\nLlama validated {len(validated_roots)} roots:")
                     for i, root in enumerate(validated_roots):
                         print(f"  {i+1}. {root}")
+                    url_classifier.record_verdicts('store_root', [
+                        (root, 'store_root' if root in validated_roots else 'noise') for root in listed])
                     
-                    return validated_roots
+                    return confident + validated_roots
                     
             except Exception as e:
                 print(f"Error parsing Llama response: {e}")
     
     # Fallback: return pattern-detected roots
-    return sorted(potential_roots)
+    return sorted(set(confident) | set(uncertain))
 
-@app.route('/filter-links', methods=['GET'])
+@app.route('/filter-links', methods=['GET', 'POST'])
 def filter_links():
     """
     Crawl entire website and filter ALL discovered URLs containing a root pattern
     Expected: GET /filter-links?url=https://example.com&root=/pattern/to/match/
+    Several roots at once: repeat &root=..., or POST {"url": "...", "roots": ["/en/stores/", "/fr/boutiques/"]}
+    Matches come from the site's cached crawl (CRAWL_CACHE_TTL, e.g. the one /discover-roots just did);
+    add &refresh=1 to crawl again. With several roots, links are also grouped per root in links_by_root
+    Add &stream=1 for NDJSON chunks of matches as the crawl proceeds (unsorted), then a summary record
     """
-    url = request.args.get('url')
-    root = request.args.get('root')
+    data = request.get_json(silent=True) if request.method == 'POST' else None
+    data = data if isinstance(data, dict) else {}
+    url = data.get('url') or request.args.get('url')
+    roots = data.get('roots') or request.args.getlist('root')
+    if isinstance(roots, str):
+        roots = [roots]
+    roots = [root for root in dict.fromkeys(roots) if isinstance(root, str) and root]
+    refresh = bool(data.get('refresh')) or request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
     
     if not url:
         return jsonify({'error': 'Missing url parameter'}), 400
-    if not root:
+    if not roots:
         return jsonify({'error': 'Missing root parameter'}), 400
 
+    if wants_stream():
+        return stream_ndjson(stream_filter_links(url, roots))
+
     try:
         print(f"🔍 Full site crawling: {url}")
-        print(f"🎯 Filtering for root pattern: {root}")
-        
-        # Use the same comprehensive crawling as discover-roots
-        all_urls = crawl_website(url)
+        print(f"🎯 Filtering for root patterns: {roots}")
         
-        print(f"📊 Found {len(all_urls)} total URLs from comprehensive crawling")
+        # Use the same comprehensive crawling as discover-roots, indexed once per crawl
+        index, cache_hit = cached_crawl(url, refresh)
         
-        # Filter URLs containing the root pattern
-        filtered_links = []
-        for discovered_url in all_urls:
-            # Filter: keep only URLs containing the root pattern
-            if root.lower() in discovered_url.lower():
-                filtered_links.append(discovered_url)
+        print(f"📊 {len(index)} total URLs from comprehensive crawling{' (cached)' if cache_hit else ''}")
         
-        # Remove duplicates and sort
-        unique_filtered_links = list(set(filtered_links))
-        unique_filtered_links.sort()
+        # Filter URLs containing each root pattern, all against the same index
+        start = time.perf_counter()
+        with metrics.stage(SERVICE, 'filter_links'):
+            links_by_root = index.match(roots)
+            if len(roots) == 1:
+                unique_filtered_links = links_by_root[roots[0]]
+            else:
+                unique_filtered_links = sorted(set().union(*links_by_root.values()))
+        filter_ms = (time.perf_counter() - start) * 1000
         
-        print(f"✅ Found {len(unique_filtered_links)} URLs containing '{root}'")
+        print(f"✅ Found {len(unique_filtered_links)} URLs containing {roots} in {filter_ms:.1f} ms")
         
         return jsonify({
             'success': True,
             'crawled_url': url,
-            'root_filter': root,
-            'total_urls_discovered': len(all_urls),
+            'root_filter': roots[0] if len(roots) == 1 else roots,
+            'total_urls_discovered': len(index),
             'filtered_links': unique_filtered_links,
-            'filtered_count': len(unique_filtered_links)
+            'filtered_count': len(unique_filtered_links),
+            'links_by_root': links_by_root if len(roots) > 1 else None,  # single root: same as filtered_links
+            'counts_by_root': {root: len(links) for root, links in links_by_root.items()},
+            'crawl_cached': cache_hit,
+            'filter_ms': round(filter_ms, 2)
         })
         
     except Exception as e:
@@ -472,11 +718,47 @@ def filter_links():
             'success': False,
             'error': f'Error crawling website: {str(e)}',
             'crawled_url': url,
-            'root_filter': root
+            'root_filter': roots[0] if len(roots) == 1 else roots
         }), 500
 
 
+def stream_filter_links(url, roots):
+    roots_lower = [(root, root.lower()) for root in roots]
+    counts = {'total': 0, 'matched': 0, 'by_root': {root: 0 for root in roots}}
+
+    def matches():
+        for discovered_url in iter_website_urls(url):
+            counts['total'] += 1
+            url_lower = discovered_url.lower()
+            matched = [root for root, root_lower in roots_lower if root_lower in url_lower]
+            if matched:
+                counts['matched'] += 1
+                for root in matched:
+                    counts['by_root'][root] += 1
+                yield discovered_url
+
+    error = None
+    try:
+        for chunk in iter_url_chunks(matches()):
+            yield {'type': 'matches', 'filtered_links': chunk}
+    except Exception as e:
+        print(f"💥 Error: {str(e)}")
+        error = f'Error crawling website: {str(e)}'
+        yield {'type': 'error', 'error': error}
+
+    yield {
+        'type': 'summary',
+        'success': error is None,
+        'crawled_url': url,
+        'root_filter': roots[0] if len(roots) == 1 else roots,
+        'total_urls_discovered': counts['total'],
+        'filtered_count': counts['matched'],
+        'counts_by_root': counts['by_root']
+    }
+
+
 @app.route('/discover-roots', methods=['GET'])
+@llm_usage.tracked('discover_roots')
 def discover_roots():
     """Find root URLs where individual store pages are built from"""
     homepage = request.args.get('url')
@@ -485,11 +767,33 @@ def discover_roots():
     if not homepage:
         return jsonify({'error': 'Missing url parameter'}), 400
 
-    # Crawl website
-    all_urls = crawl_website(homepage)
+    refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes')
+
+    # Crawl website, then keep one URL per page across languages (add &collapse_locales=0 to keep all)
+    alternates = {}
+    all_urls = crawl_website(homepage, alternates)
+    groups = None
+    candidate_urls = all_urls
+    if wants_locale_collapse():
+        candidate_urls, groups = collapse_locales(all_urls, alternates)
+
+    # Roots confirmed on an earlier run are reused while the crawl still has pages under them
+    known_roots = [] if refresh else site_profile.get_profile(homepage).get('store_roots') or []
+    live_roots = [root for root in known_roots if any(url.startswith(root) for url in candidate_urls)]
 
     # Find store roots
-    store_roots = find_store_roots(all_urls)
+    if live_roots:
+        print(f"Using {len(live_roots)} store roots from the site profile")
+        store_roots = live_roots
+    else:
+        store_roots = find_store_roots(candidate_urls)
+        if store_roots:
+            site_profile.update_profile(homepage, store_roots=store_roots)
+
+    export.export_records('store_roots', [
+        {'website': homepage, 'root': root, 'source': 'profile' if live_roots else 'analysis'}
+        for root in store_roots
+    ])
 
     # Optional filter
     if filter_text:
@@ -501,7 +805,13 @@ def discover_roots():
         'store_roots': store_roots,
         'roots_count': len(store_roots),
         'filtered_by': filter_text if filter_text else None,
-        'usage': 'Append store names to these roots to build individual store URLs'
+        'usage': 'Append store names to these roots to build individual store URLs',
+        'roots_source': 'profile' if live_roots else 'analysis',
+        'locale_groups': len(groups) if groups is not None else None,
+        'root_alternates': {
+            root: locale_groups.alternate_roots(root, groups) for root in store_roots
+        } if groups else None,
+        **llm_usage.current_job().summary()
     })
 
 
@@ -509,11 +819,17 @@ def discover_roots():
 
 @app.route('/crawl-only', methods=['GET'])
 def crawl_only():
-    """Only crawl website and return all URLs (no Llama analysis)"""
+    """
+    Only crawl website and return all URLs (no Llama analysis)
+    Add &stream=1 for NDJSON chunks of URLs as they are discovered (unsorted), then a summary record
+    """
     homepage = request.args.get('url')
     if not homepage:
         return jsonify({'error': 'Missing url parameter'}), 400
 
+    if wants_stream():
+        return stream_ndjson(stream_crawl(homepage))
+
     # Just crawl website
     all_urls = crawl_website(homepage)
     
@@ -523,6 +839,20 @@ def crawl_only():
         'all_urls': all_urls
     })
 
+def stream_crawl(homepage):
+    total = 0
+    try:
+        for chunk in iter_url_chunks(iter_website_urls(homepage)):
+            total += len(chunk)
+            if export.enabled():
+                export.export_records('crawl_urls', [{'website': homepage, 'url': url} for url in chunk])
+            yield {'type': 'urls', 'urls': chunk}
+    except Exception as e:
+        print(f"💥 Error: {str(e)}")
+        yield {'type': 'error', 'error': f'Error crawling website: {str(e)}'}
+
+    yield {'type': 'summary', 'website': homepage, 'total_urls': total}
+
 @app.route('/llama', methods=['POST'])
 def llama_endpoint():
     """Expose Llama via endpoint - send prompt, get response"""
@@ -532,17 +862,21 @@ def llama_endpoint():
         return jsonify({'error': 'Missing prompt in request body'}), 400
     
     prompt = data['prompt']
-    max_tokens = data.get('max_tokens', 1000)
+    try:
+        max_tokens = llm_usage.clamp_max_tokens(data.get('max_tokens', 1000))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'max_tokens must be an integer'}), 400
     temperature = data.get('temperature', 0.1)
     
     # Use centralized Llama call
-    llama_result = call_llama(prompt, max_tokens, temperature)
+    with llm_usage.job('llama', budget=data.get('token_budget') or llm_usage.DEFAULT_JOB_BUDGET):
+        llama_result = call_llama(prompt, max_tokens, temperature)
     
     if llama_result["success"]:
         return jsonify({
             'prompt': prompt,
             'response': llama_result["response"],
-            'model': 'meta-llama/Llama-4-Maverick-17B-128E-Instruct',
+            'model': llm_client.for_task(SERVICE, 'llama', LLAMA_MODEL).model,
             'max_tokens': max_tokens,
             'temperature': temperature
         })
@@ -551,6 +885,7 @@ def llama_endpoint():
 
 
 @app.route('/discover', methods=['GET'])
+@llm_usage.tracked('discover')
 def discover():
     """Find store directory pages"""
     homepage = request.args.get('url')
@@ -559,11 +894,16 @@ def discover():
     if not homepage:
         return jsonify({'error': 'Missing url parameter'}), 400
 
-    # Crawl website
-    all_urls = crawl_website(homepage)
+    # Crawl website, then keep one URL per page across languages (add &collapse_locales=0 to keep all)
+    alternates = {}
+    all_urls = crawl_website(homepage, alternates)
+    groups = None
+    candidate_urls = all_urls
+    if wants_locale_collapse():
+        candidate_urls, groups = collapse_locales(all_urls, alternates)
 
     # Find directory pages
-    directories = find_directory_pages(all_urls)
+    directories = find_directory_pages(candidate_urls)
 
     # Filter results if filter_text is provided
     if filter_text:
@@ -574,15 +914,109 @@ def discover():
         'total_urls': len(all_urls),
         'discovered_urls': directories,
         'directory_count': len(directories),
-        'filtered_by': filter_text if filter_text else None
+        'filtered_by': filter_text if filter_text else None,
+        'locale_groups': len(groups) if groups is not None else None,
+        'alternates': {url: groups.get(url, {}) for url in directories} if groups else None,
+        **llm_usage.current_job().summary()
     })
 
 
+SHOP_FIELDS = """- store_name: The name of the store/shop (this can not be the same as the mall name)
+           - description: Brief description of what they sell or do
+           - phone: Phone number
+           - hours: Opening hours or schedule
+           - website: Store website URL
+           - email: Email address
+           - location: Floor, unit number, or specific location within mall
+           - categories: Array of what they sell (clothing, food, electronics, etc.)
+           - services: Array of services they offer"""
+
+SHOP_KEYS = ['store_name', 'description', 'phone', 'hours', 'website', 'email', 'location', 'categories',
+             'services']
+
+SHOP_JSON = '{"store_name": "...", "description": "...", "phone": "...", "hours": "...", "website": "...", "email": "...", "location": "...", "categories": [...], "services": [...]}'
+
+def build_shop_prompt(clean_text):
+    return f"""Extract store/shop information from this webpage text. Return JSON only.
+
+           Store page text:
+           {clean_text}
+
+           Extract these fields if available (use null if not found):
+           {SHOP_FIELDS}
+
+       JSON ONLY:
+       {SHOP_JSON}"""
+
+def build_shop_batch_prompt(texts):
+    pages = "\n\n".join(f"           PAGE {i}:\n           {text}" for i, text in enumerate(texts, 1))
+    return f"""Extract store/shop information from each of these {len(texts)} webpage texts. Return JSON only.
+
+{pages}
+
+           For EACH page extract these fields if available (use null if not found):
+           {SHOP_FIELDS}
+
+       JSON ONLY, one object per page, with its page number:
+       {{"shops": [{{"page": 1, "store_name": "...", ...}}, {{"page": 2, "store_name": "...", ...}}]}}"""
+
+def extract_shops_batched(items):
+    """One Llama call for several shop pages, split back out per page into call_llama-style results.
+    items are (page text, llm_usage job) pairs: each page is checked against, and charged to, its own request"""
+    def extract_one(text, job):
+        with llm_usage.attached(job):
+            return call_llama(build_shop_prompt(text), max_tokens=800, temperature=0.0,
+                              task='shop_extract', stream_json=True)
+
+    results = [None] * len(items)
+    allowed = []
+    for i, (text, job) in enumerate(items):
+        with llm_usage.attached(job):
+            if llm_usage.check_budget(SERVICE, build_shop_prompt(text)):
+                allowed.append(i)
+            else:
+                results[i] = budget_exceeded_result()
+    if len(allowed) <= 1:
+        for i in allowed:
+            results[i] = extract_one(*items[i])
+        return results
+
+    texts = [items[i][0] for i in allowed]
+    print(f"🤖 Sending {len(texts)} shops to Llama in one batch...")
+    # The batch's tokens are split between the requests by page length
+    with llm_usage.attached(llm_usage.SharedJob([(items[i][1], len(items[i][0])) for i in allowed])):
+        llama_result = call_llama(
+            build_shop_batch_prompt(texts),
+            max_tokens=llm_usage.clamp_max_tokens(600 * len(texts)),
+            temperature=0.0,
+            task='shop_extract',
+            stream_json=True
+        )
+
+    shops = {}
+    if llama_result["success"]:
+        parsed = extract_json_from_response(llama_result["response"])
+        for shop in (parsed or {}).get("shops", []) if isinstance(parsed, dict) else []:
+            if isinstance(shop, dict) and isinstance(shop.get("page"), int):
+                shops[shop["page"]] = {k: v for k, v in shop.items() if k != "page"}
+
+    for page, i in enumerate(allowed, 1):
+        if page in shops:
+            results[i] = {"success": True, "response": json.dumps(shops[page]), "error": None}
+        else:
+            # Missing from the batched answer: extract this one on its own
+            results[i] = extract_one(*items[i])
+    return results
+
+shop_batcher = MicroBatcher(extract_shops_batched, max_size=PARSE_SHOP_BATCH_SIZE, max_wait=PARSE_SHOP_BATCH_WAIT)
+
 @app.route('/parse-shop', methods=['GET'])
+@llm_usage.tracked('parse_shop')
 def parse_shop():
    """
    Extract structured information from a shop/store page
    Expected: GET /parse-shop?url=https://example.com/store/shop-name
+   Add &batch=1 (or set PARSE_SHOP_BATCH) to share one Llama call with concurrent parse-shop requests
    """
    rate_limit()  # Add rate limiting
    
@@ -605,50 +1039,36 @@ def parse_shop():
            }), 200  # Return 200 to not break n8n
        
        # Parse HTML and clean it
-       soup = BeautifulSoup(response.content, 'html.parser')
-       
-       # Remove noise elements
-       for element in soup(['script', 'style', 'nav', 'header', 'footer', 'aside', 'iframe']):
-           element.decompose()
-       
-       # Get clean text
-       clean_text = soup.get_text(separator=' ', strip=True)
-       
-       # Limit text length for LLM (keep it reasonable)
-       if len(clean_text) > 3000:
-           clean_text = clean_text[:3000] + "..."
+       with metrics.stage(SERVICE, 'html_parse'):
+           soup = BeautifulSoup(response.content, 'html.parser')
+           alternates = locale_groups.html_alternates(soup, response.url or url)
+           
+           # Remove noise elements
+           for element in soup(['script', 'style', 'nav', 'header', 'footer', 'aside', 'iframe']):
+               element.decompose()
+           
+           # Get clean text: the most relevant blocks that fit the LLM window (keep it reasonable)
+           clean_text = content_extract.select_main_content(soup, 3000, site=urlparse(url).netloc.lower(),
+                                                            page=url)
        
        print(f"📝 Extracted {len(clean_text)} characters of clean text")
        
        # Use Llama to extract structured information
-       prompt = f"""Extract store/shop information from this webpage text. Return JSON only.
-
-           Store page text:
-           {clean_text}
-
-           Extract these fields if available (use null if not found):
-           - store_name: The name of the store/shop (this can not be the same as the mall name)
-           - description: Brief description of what they sell or do
-           - phone: Phone number
-           - hours: Opening hours or schedule
-           - website: Store website URL
-           - email: Email address
-           - location: Floor, unit number, or specific location within mall
-           - categories: Array of what they sell (clothing, food, electronics, etc.)
-           - services: Array of services they offer
-
-       JSON ONLY:
-       {{"store_name": "...", "description": "...", "phone": "...", "hours": "...", "website": "...", "email": "...", "location": "...", "categories": [...], "services": [...]}}"""
-
-       print(f"🤖 Sending to Llama for information extraction...")
-       
-       # Call Llama using our centralized function
-       llama_result = call_llama(prompt, max_tokens=800, temperature=0.0)
+       batch = request.args.get('batch', '').lower() in ('1', 'true', 'yes') or PARSE_SHOP_BATCH
+       if batch:
+           llama_result = shop_batcher.submit((clean_text, llm_usage.current_job()))
+       else:
+           print(f"🤖 Sending to Llama for information extraction...")
+           
+           # Call Llama using our centralized function
+           llama_result = call_llama(build_shop_prompt(clean_text), max_tokens=800, temperature=0.0,
+                                     task='shop_extract', stream_json=True)
        
        if not llama_result["success"]:
            return jsonify({
                'success': False,
                'error': f'Llama processing failed: {llama_result["error"]}',
+               'budget_exceeded': bool(llama_result.get("budget_exceeded")),
                'shop_url': url
            }), 200  # Return 200 to not break n8n
        
@@ -660,11 +1080,14 @@ def parse_shop():
        
        if extracted_info:
            print(f"✅ Successfully extracted shop information")
+           export.export_records('shops', [{**{key: extracted_info.get(key) for key in SHOP_KEYS},
+                                              'shop_url': url, 'domain': urlparse(url).netloc.lower()}])
            
            return jsonify({
                'success': True,
                'shop_url': url,
                'extracted_info': extracted_info,
+               'alternates': alternates,  # the same shop page in other languages (hreflang)
                'raw_text_length': len(clean_text)
            })
        else:
@@ -684,5 +1107,77 @@ def parse_shop():
            'shop_url': url
        }), 200  # Return 200 to not break n8n
 
+def label_directory_fields(records):
+    """One Llama call per directory page labels the repeated fields; heuristics fill in without it"""
+    labels = directory_extract.heuristic_labels(records)
+    result = call_llama(directory_extract.build_label_prompt(records), max_tokens=300, temperature=0.0,
+                        task='directory_labels', stream_json=True)
+    if not result["success"]:
+        return labels, 'heuristic'
+    parsed = extract_json_from_response(result["response"]) or {}
+    llm_labels = parsed.get('labels') if isinstance(parsed.get('labels'), dict) else parsed
+    llm_labels = {k: v for k, v in llm_labels.items() if v in directory_extract.LABELS and any(k in r['fields'] for r in records)}
+    if 'store_name' not in llm_labels.values():
+        return labels, 'heuristic'
+    return llm_labels, 'llm'
+
+
+@app.route('/extract-directory', methods=['GET'])
+@llm_usage.tracked('extract-directory')
+def extract_directory():
+    """
+    Extract every store listed on a directory page (as returned by /discover) without per-store Llama calls
+    Expected: GET /extract-directory?url=https://example.com/stores/
+    Stores only need /parse-shop afterwards when the directory lacks the details you want
+    """
+    rate_limit()
+
+    url = request.args.get('url')
+
+    if not url:
+        return jsonify({'error': 'Missing url parameter'}), 400
+
+    response = safe_request(url, timeout=15)
+    if not response:
+        return jsonify({
+            'success': False,
+            'error': 'Failed to fetch directory page (network/DNS issue)',
+            'directory_url': url
+        }), 200  # Return 200 to not break n8n
+
+    with metrics.stage(SERVICE, 'directory_extract'):
+        soup = BeautifulSoup(response.content, 'html.parser')
+        # Menus and footers are repeated link lists too; drop them as parse_shop does
+        for element in soup(['script', 'style', 'nav', 'header', 'footer', 'aside', 'iframe']):
+            element.decompose()
+        records = directory_extract.extract_records(soup, response.url or url)
+
+    if not records:
+        return jsonify({
+            'success': False,
+            'error': 'No repeated store records found on page (try /parse-shop per store)',
+            'directory_url': url
+        }), 200
+
+    labels, labels_source = label_directory_fields(records)
+    stores = directory_extract.apply_labels(records, labels)
+    print(f"📇 Extracted {len(stores)} stores from {url} (labels: {labels_source})")
+
+    domain = urlparse(url).netloc.lower()
+    export.export_records('directory_stores', [
+        {**{k: v for k, v in store.items() if k != 'fields'}, 'directory_url': url, 'domain': domain}
+        for store in stores
+    ])
+
+    return jsonify({
+        'success': True,
+        'directory_url': url,
+        'stores': stores,
+        'store_count': len(stores),
+        'field_labels': labels,
+        'labels_source': labels_source,
+        **llm_usage.current_job().summary()
+    })
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5002, debug=True)
@@ -0,0 +1,164 @@
+"""
+Store records from directory pages: find the repeated DOM template that lists the stores, then read
+every record's link and text fields from that one page. Field meanings (store name, unit, category...)
+come from one LLM labelling call per page, or from heuristics when no LLM answer is available.
+"""
+import re
+from collections import Counter, OrderedDict
+from urllib.parse import urljoin, urlparse
+
+MIN_RECORDS = 5
+MIN_SECTION_RECORDS = 2  # a letter or category section of a larger directory
+SAMPLE_RECORDS = 5
+LABELS = ['store_name', 'unit', 'category', 'phone', 'hours', 'description', 'ignore']
+
+UNIT_TEXT = re.compile(r'\b(unit|suite|level|floor|niveau|local|nivel|piso|shop)\b\s*[#:]?\s*\w+|^#?\d{1,4}[a-z]?$', re.I)
+PHONE_TEXT = re.compile(r'^\+?[\d\s().-]{7,}$')
+HOURS_TEXT = re.compile(r'\b\d{1,2}(:\d{2})?\s?(am|pm|h)\b|\b\d{1,2}:\d{2}\b', re.I)
+
+
+def signature(element):
+    return element.name + ''.join(f".{c}" for c in sorted(element.get('class') or []))
+
+
+def links_under(members, base_url):
+    """Share of members whose link points below the directory page's own path"""
+    base = urlparse(base_url)
+    prefix = base.path if base.path.endswith('/') else base.path.rsplit('/', 1)[0] + '/'
+    under = 0
+    for member in members:
+        link = urlparse(urljoin(base_url, member.find('a', href=True)['href']))
+        own_page = link.path.rstrip('/') == base.path.rstrip('/')
+        if link.netloc == base.netloc and link.path.startswith(prefix) and not own_page:
+            under += 1
+    return under / len(members)
+
+
+def find_record_groups(soup, base_url=None):
+    """Sibling elements sharing a tag/class signature, each with a link, best groups first.
+    Sections of one directory (A-Z letters, categories) repeat the same record and parent signatures,
+    so they are merged into one group. Groups linking below base_url (the directory's stores) rank above
+    site-wide link lists such as menus"""
+    sections = OrderedDict()
+    for parent in soup.find_all(True):
+        children = [c for c in parent.find_all(True, recursive=False)]
+        if len(children) < MIN_SECTION_RECORDS:
+            continue
+        counts = Counter(signature(c) for c in children)
+        for sig, count in counts.items():
+            if count < MIN_SECTION_RECORDS:
+                continue
+            members = [c for c in children if signature(c) == sig and c.find('a', href=True)]
+            if len(members) >= MIN_SECTION_RECORDS:
+                grandparent = parent.parent.name if parent.parent is not None else ''
+                sections.setdefault((sig, signature(parent), grandparent), []).extend(members)
+    groups = [members for members in sections.values() if len(members) >= MIN_RECORDS]
+    # Prefer groups with many records whose text is more than just a link (richer templates)
+    groups.sort(key=lambda g: (base_url is not None and links_under(g, base_url) >= 0.5, len(g),
+                               sum(len(m.get_text(strip=True)) for m in g[:SAMPLE_RECORDS])), reverse=True)
+    return groups
+
+
+def field_key(node, record):
+    parts = []
+    parent = node.parent
+    while parent is not None and parent is not record:
+        classes = parent.get('class') or []
+        parts.append(parent.name + (f".{classes[0]}" if classes else ''))
+        parent = parent.parent
+    return '/'.join(reversed(parts)) or '.'
+
+
+def read_record(record, base_url):
+    fields = OrderedDict()
+    for node in record.find_all(string=True):
+        text = node.strip()
+        if not text or node.parent.name in ('script', 'style'):
+            continue
+        key = field_key(node, record)
+        fields[key] = f"{fields[key]} {text}" if key in fields else text
+    link = record.find('a', href=True)
+    image = record.find('img', alt=True)
+    if image and image['alt'].strip():
+        fields.setdefault('img@alt', image['alt'].strip())
+    return {'url': urljoin(base_url, link['href']) if link else None, 'fields': fields}
+
+
+def extract_records(soup, base_url):
+    """Raw records of the best repeated group: [{'url': ..., 'fields': {field_key: text}}]"""
+    groups = find_record_groups(soup, base_url)
+    if not groups:
+        return []
+    seen = set()
+    records = []
+    for element in groups[0]:
+        record = read_record(element, base_url)
+        if record['url'] in seen:
+            continue
+        seen.add(record['url'])
+        records.append(record)
+    return records
+
+
+def field_samples(records):
+    samples = OrderedDict()
+    for record in records[:SAMPLE_RECORDS * 4]:
+        for key, value in record['fields'].items():
+            values = samples.setdefault(key, [])
+            if len(values) < SAMPLE_RECORDS and value not in values:
+                values.append(value[:80])
+    return samples
+
+
+def build_label_prompt(records):
+    samples = field_samples(records)
+    lines = '\n'.join(f'"{key}": {values}' for key, values in samples.items())
+    return f"""RESPOND WITH ONLY JSON. NO EXPLANATIONS.
+
+These fields repeat in every record of a mall's store directory. Example values are listed per field.
+Label each field as one of: {", ".join(LABELS)}
+
+{lines}
+
+JSON ONLY:
+{{"labels": {{"field": "label"}}}}"""
+
+
+def heuristic_labels(records):
+    """Label fields from their values: link text is the store name, patterns find units, phones, hours"""
+    labels = {}
+    samples = field_samples(records)
+    link_keys = [key for key in samples if key == 'a' or key.startswith('a/') or '/a/' in key or key.endswith('/a')]
+    name_candidates = link_keys or list(samples)
+    for key, values in samples.items():
+        joined = ' '.join(values)
+        if values and all(PHONE_TEXT.match(v) for v in values):
+            labels[key] = 'phone'
+        elif values and sum(bool(UNIT_TEXT.search(v)) for v in values) >= len(values) / 2:
+            labels[key] = 'unit'
+        elif HOURS_TEXT.search(joined):
+            labels[key] = 'hours'
+    names = [key for key in name_candidates if key not in labels]
+    if names:
+        # The name is the shortest distinct text among link fields
+        labels[min(names, key=lambda k: sum(len(v) for v in samples[k]) or 1e9)] = 'store_name'
+    for key in samples:
+        if key not in labels and any(w in key.lower() for w in ('cat', 'type', 'tag')):
+            labels[key] = 'category'
+    return labels
+
+
+def apply_labels(records, labels):
+    """Turn raw records into store dicts using a field -> label mapping"""
+    stores = []
+    for record in records:
+        store = {'url': record['url']}
+        for key, value in record['fields'].items():
+            label = labels.get(key)
+            if label and label != 'ignore' and label in LABELS:
+                store[label] = f"{store[label]} {value}" if label in store else value
+        if not store.get('store_name'):
+            continue
+        store['fields'] = dict(record['fields'])
+        stores.append(store)
+    return stores
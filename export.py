@@ -0,0 +1,203 @@
+"""
+Append-only Parquet export of crawl and extraction results, for cheap columnar reads downstream.
+
+Set EXPORT_DIR to enable. Rows are buffered per dataset and written as new files under
+    EXPORT_DIR/dataset=<name>/date=<YYYY-MM-DD>/run=<run id>/part-<n>.parquet
+(hive-style partitions, so pd.read_parquet(EXPORT_DIR + "/dataset=shops") reads them back).
+Files are never rewritten; every flush adds one. Each dataset is written with its fixed schema in SCHEMAS,
+so a flush where a column happens to be all null still agrees with the others, and keys outside the
+schema are dropped.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+EXPORT_DIR = os.environ.get("EXPORT_DIR")
+RUN_ID = os.environ.get("EXPORT_RUN_ID") or time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+FLUSH_ROWS = int(os.environ.get("EXPORT_FLUSH_ROWS", 50000))
+FLUSH_SECONDS = float(os.environ.get("EXPORT_FLUSH_SECONDS", 60))
+# Rows of failed writes are kept for the next flush, up to this many per dataset (oldest dropped first)
+MAX_BUFFER_ROWS = int(os.environ.get("EXPORT_MAX_BUFFER_ROWS", 10 * FLUSH_ROWS))
+
+# Columns that hold lists of strings; any other list or dict value is stored as a JSON string
+LIST_COLUMNS = {
+    'shops': {'categories', 'services'},
+}
+
+COMMON_FIELDS = [('exported_at', pa.timestamp('us', tz='UTC')), ('run_id', pa.string())]
+SCHEMAS = {
+    'crawl_urls': pa.schema([('website', pa.string()), ('url', pa.string())] + COMMON_FIELDS),
+    'store_roots': pa.schema([('website', pa.string()), ('root', pa.string()), ('source', pa.string())]
+                             + COMMON_FIELDS),
+    'shops': pa.schema([
+        ('store_name', pa.string()), ('description', pa.string()), ('phone', pa.string()), ('hours', pa.string()),
+        ('website', pa.string()), ('email', pa.string()), ('location', pa.string()),
+        ('categories', pa.list_(pa.string())), ('services', pa.list_(pa.string())),
+        ('shop_url', pa.string()), ('domain', pa.string()),
+    ] + COMMON_FIELDS),
+    'directory_stores': pa.schema([
+        ('url', pa.string()), ('store_name', pa.string()), ('unit', pa.string()), ('category', pa.string()),
+        ('phone', pa.string()), ('hours', pa.string()), ('description', pa.string()),
+        ('directory_url', pa.string()), ('domain', pa.string()),
+    ] + COMMON_FIELDS),
+    'brand_matches': pa.schema([
+        ('store_query', pa.string()), ('matched_brand', pa.string()), ('brand_id', pa.string()),
+        ('score', pa.float64()), ('source', pa.string()),
+    ] + COMMON_FIELDS),
+}
+
+buffers = {}  # dataset -> {'rows': [...], 'since': timestamp, 'retry_at': timestamp after a failed write}
+buffers_lock = threading.Lock()
+flusher = None
+
+
+def enabled():
+    return bool(EXPORT_DIR)
+
+
+def normalize_value(dataset, column, value):
+    schema = SCHEMAS.get(dataset)
+    field = schema.field(column) if schema is not None and column in schema.names else None
+    if column in LIST_COLUMNS.get(dataset, ()):
+        if value is None:
+            return []
+        if not isinstance(value, list):
+            value = [value]
+        return [v if isinstance(v, str) else json.dumps(v) for v in value if v is not None]
+    if value is None:
+        return None
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, ensure_ascii=False)
+    if field is not None and pa.types.is_string(field.type) and not isinstance(value, str):
+        return str(value)  # e.g. a phone number the LLM answered as a number
+    if field is not None and pa.types.is_floating(field.type):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    return value
+
+
+def export_records(dataset, records):
+    """Buffer rows for dataset; written once FLUSH_ROWS rows or FLUSH_SECONDS have accumulated"""
+    if not EXPORT_DIR or not records:
+        return
+    exported_at = pd.Timestamp.now(tz='UTC')
+    schema = SCHEMAS.get(dataset)
+    rows = []
+    for record in records:
+        row = {column: normalize_value(dataset, column, value) for column, value in record.items()
+               if schema is None or column in schema.names}
+        row['exported_at'] = exported_at
+        rows.append(row)
+
+    with buffers_lock:
+        buffer = buffers.setdefault(dataset, {'rows': [], 'since': time.time(), 'retry_at': 0})
+        buffer['rows'].extend(rows)
+        due = is_due(buffer, time.time())
+    start_flusher()
+    if due:
+        flush(dataset)
+
+
+def is_due(buffer, now):
+    if now < buffer['retry_at']:
+        return False
+    return len(buffer['rows']) >= FLUSH_ROWS or now - buffer['since'] >= FLUSH_SECONDS
+
+
+def flush(dataset=None):
+    """Write buffered rows (of one dataset, or all) to new Parquet files. Returns the paths written.
+    Rows whose write failed go back to the front of their buffer and are retried after FLUSH_SECONDS"""
+    with buffers_lock:
+        names = [dataset] if dataset else list(buffers)
+        pending = {}
+        for name in names:
+            buffer = buffers.pop(name, None)
+            if buffer and buffer['rows']:
+                pending[name] = buffer
+
+    paths = []
+    for name, failed in pending.items():
+        path = write_partition(name, failed['rows'])
+        if path:
+            paths.append(path)
+            continue
+        with buffers_lock:
+            buffer = buffers.setdefault(name, {'rows': [], 'since': failed['since'], 'retry_at': 0})
+            buffer['rows'][:0] = failed['rows']
+            buffer['since'] = min(buffer['since'], failed['since'])
+            buffer['retry_at'] = time.time() + FLUSH_SECONDS
+            dropped = len(buffer['rows']) - MAX_BUFFER_ROWS
+            if dropped > 0:
+                del buffer['rows'][:dropped]
+                print(f"Export buffer for {name} full, dropped its {dropped} oldest rows")
+    return paths
+
+
+def flush_idle():
+    """Flush buffers that are due even when no new rows arrive to trigger it"""
+    while True:
+        time.sleep(max(1.0, FLUSH_SECONDS / 4))
+        now = time.time()
+        with buffers_lock:
+            due = [name for name, buffer in buffers.items() if buffer['rows'] and is_due(buffer, now)]
+        for name in due:
+            flush(name)
+
+
+def start_flusher():
+    global flusher
+    with buffers_lock:
+        if flusher is None:
+            flusher = threading.Thread(target=flush_idle, name='export-flusher', daemon=True)
+            flusher.start()
+
+
+def write_partition(dataset, rows):
+    directory = os.path.join(EXPORT_DIR, f"dataset={dataset}", f"date={time.strftime('%Y-%m-%d')}",
+                             f"run={RUN_ID}")
+    path = os.path.join(directory, f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        schema = SCHEMAS.get(dataset)
+        if schema is not None:
+            table = pa.Table.from_pylist([{**row, 'run_id': RUN_ID} for row in rows], schema=schema)
+            pq.write_table(table, tmp_path)
+        else:
+            frame = pd.DataFrame.from_records(rows)
+            frame['run_id'] = RUN_ID
+            frame.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)  # readers never see half-written files
+    except Exception as e:
+        print(f"Export of {len(rows)} {dataset} rows failed: {e}")
+        return None
+    print(f"📦 Exported {len(rows)} {dataset} rows to {path}")
+    return path
+
+
+def read_dataset(dataset, export_dir=None):
+    """All exported rows of a dataset as one DataFrame (partition columns date and run included)"""
+    return pd.read_parquet(os.path.join(export_dir or EXPORT_DIR, f"dataset={dataset}"))
+
+
+def register_endpoint(app):
+    """Add POST /export/flush to write everything buffered now"""
+    from flask import jsonify
+
+    def flush_endpoint():
+        if not EXPORT_DIR:
+            return jsonify({'error': 'Export disabled, set EXPORT_DIR'}), 400
+        return jsonify({'written': flush()})
+    app.add_url_rule('/export/flush', 'export_flush', flush_endpoint, methods=['POST'])
+
+
+atexit.register(flush)  # whatever the idle flusher hasn't written yet, including rows of failed writes
@@ -0,0 +1,80 @@
+"""
+Streaming HTTP fetches with a byte cap and content-type checks made before the body is downloaded.
+Advertises brotli/zstd on top of gzip/deflate when their decoders (brotli, zstandard) are installed.
+"""
+import os
+import zlib
+
+from urllib3.util.request import ACCEPT_ENCODING  # "gzip,deflate" plus ",br" / ",zstd" when decodable
+
+MAX_BODY_BYTES = int(os.environ.get("FETCH_MAX_BYTES", 10 * 1024 * 1024))
+SITEMAP_MAX_BYTES = int(os.environ.get("SITEMAP_MAX_BYTES", 50 * 1024 * 1024))  # sitemaps.org limit
+CHUNK_SIZE = 64 * 1024
+
+HTML_TYPES = ('text/html', 'application/xhtml+xml')
+SITEMAP_TYPES = ('xml', 'text/plain', 'text/html', 'gzip', 'octet-stream')
+TEXT_TYPES = ('text/',)
+
+
+class FetchRefused(Exception):
+    """The response was not downloaded: wrong content type, or declared larger than the cap"""
+
+
+def read_capped(response, max_bytes):
+    """Read a streamed response's decoded body up to max_bytes. Returns (body, truncated)"""
+    chunks = []
+    total = 0
+    truncated = False
+    try:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            chunks.append(chunk)
+            total += len(chunk)
+            if total > max_bytes:
+                truncated = True
+                break
+    finally:
+        response.close()
+    body = b''.join(chunks)
+    return (body[:max_bytes], truncated)
+
+
+def fetch(get, url, max_bytes=MAX_BODY_BYTES, allowed_types=None, refuse_oversized=True, **kwargs):
+    """
+    GET url with get (requests.get or a Session's get) as a stream, check headers, then read at most
+    max_bytes. Returns the response with its body loaded, so .content and .text work as usual, and
+    response.truncated set. Raises FetchRefused instead of downloading a body we would throw away;
+    with refuse_oversized=False a body declared larger than max_bytes is read up to the cap instead (a sniff).
+    """
+    headers = dict(kwargs.pop('headers', None) or {})
+    headers.setdefault('Accept-Encoding', ACCEPT_ENCODING)
+    response = get(url, stream=True, headers=headers, **kwargs)
+
+    content_type = response.headers.get('Content-Type', '').lower()
+    if allowed_types and content_type and not any(t in content_type for t in allowed_types):
+        response.close()
+        raise FetchRefused(f"{url}: unexpected content type {content_type}")
+
+    declared = response.headers.get('Content-Length', '')
+    if refuse_oversized and declared.isdigit() and int(declared) > max_bytes:
+        response.close()
+        raise FetchRefused(f"{url}: {declared} bytes is over the {max_bytes} byte cap")
+
+    body, truncated = read_capped(response, max_bytes)
+    if truncated:
+        print(f"Body of {url} truncated at {max_bytes} bytes")
+    response._content = body
+    response._content_consumed = True
+    response.truncated = truncated
+    return response
+
+
+def gunzip_capped(body, max_bytes=SITEMAP_MAX_BYTES):
+    """Decompress a gzip file body (e.g. sitemap.xml.gz), stopping at max_bytes; other bodies pass through"""
+    if not body.startswith(b'\x1f\x8b'):
+        return body
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        return decompressor.decompress(body, max_bytes)
+    except zlib.error as e:
+        print(f"Could not decompress gzip body: {e}")
+        return b''
@@ -0,0 +1,69 @@
+"""
+Incremental JSON object scanner for LLM output.
+
+Models wrap their JSON in prose or ``` fences and often keep writing after it closes. The scanner is fed text
+as it arrives and reports the first top-level object that parses, so streaming callers can stop generation
+there and non-streaming callers get a parser that isn't fooled by braces in trailing text.
+"""
+import json
+
+
+class JSONObjectScanner:
+    def __init__(self):
+        self.text = ''
+        self.value = None
+        self.end = None  # index just past the object, once found
+        self.pos = 0
+        self.start = None
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    @property
+    def done(self):
+        return self.end is not None
+
+    def feed(self, chunk):
+        """Add text; returns the parsed object once the first complete, valid one has been seen, else None"""
+        if self.done:
+            return self.value
+        self.text += chunk
+        text = self.text
+        i = self.pos
+        while i < len(text):
+            char = text[i]
+            if self.start is None:
+                if char == '{':
+                    self.start, self.depth, self.in_string, self.escape = i, 1, False, False
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                self.depth += 1
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    try:
+                        value = json.loads(text[self.start:i + 1])
+                    except ValueError:
+                        # Not JSON after all ("{name}" in prose): look for an object starting further in
+                        i, self.start = self.start + 1, None
+                        continue
+                    self.value, self.end, self.pos = value, i + 1, i + 1
+                    return value
+            i += 1
+        self.pos = i
+        return None
+
+
+def extract_json(text):
+    """First complete JSON object in text, or None"""
+    if not text:
+        return None
+    return JSONObjectScanner().feed(text)
@@ -0,0 +1,149 @@
+"""
+Interchangeable LLM providers behind one interface, and per-task routing between them.
+
+Backends make a single chat completion attempt: `await backend.create(model, prompt, max_tokens, temperature)`
+returns an OpenAI-style completion, and `backend.stream(...)` is an async generator of text deltas; closing it
+early cancels the rest of the generation. Retries, concurrency and the circuit breaker live in llm_client.
+
+    remote  Hugging Face inference providers (Fireworks by default), HF_TOKEN
+    local   an OpenAI-compatible server on this host, e.g. llama.cpp's `llama-server` (LLM_LOCAL_URL)
+    stub    deterministic canned answers, no network (benchmarks, offline development)
+
+LLM_BACKEND picks the default backend. LLM_ROUTES sends individual tasks elsewhere, optionally with a model:
+    LLM_ROUTES="store_roots=local,directory_labels=local:qwen2.5-1.5b-instruct,shop_extract=remote"
+"""
+import asyncio
+import os
+from types import SimpleNamespace
+
+from huggingface_hub import AsyncInferenceClient
+
+REQUEST_TIMEOUT = 60
+DEFAULT_BACKEND = os.environ.get("LLM_BACKEND", "remote")
+REMOTE_PROVIDER = os.environ.get("LLM_REMOTE_PROVIDER", "fireworks-ai")
+LOCAL_URL = os.environ.get("LLM_LOCAL_URL", "http://127.0.0.1:8080")
+LOCAL_MODEL = os.environ.get("LLM_LOCAL_MODEL", "local")
+LOCAL_TIMEOUT = float(os.environ.get("LLM_LOCAL_TIMEOUT", 120))
+
+
+class RemoteBackend:
+    """Hosted models through huggingface_hub's inference providers"""
+
+    def __init__(self, provider=REMOTE_PROVIDER):
+        self.provider = provider
+        self.client = None
+
+    def default_model(self, model):
+        return model
+
+    def get_client(self):
+        if self.client is None:  # created on the event loop that uses it
+            self.client = AsyncInferenceClient(provider=self.provider, api_key=os.environ.get("HF_TOKEN"),
+                                               timeout=REQUEST_TIMEOUT)
+        return self.client
+
+    async def create(self, model, prompt, max_tokens, temperature, stream=False):
+        return await self.get_client().chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=stream
+        )
+
+    async def stream(self, model, prompt, max_tokens, temperature):
+        chunks = await self.create(model, prompt, max_tokens, temperature, stream=True)
+        try:
+            async for chunk in chunks:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            # Dropping the connection is what stops the provider generating
+            await chunks.aclose()
+
+
+class LocalBackend(RemoteBackend):
+    """A CPU model served on this host through the OpenAI-compatible /v1/chat/completions API"""
+
+    def __init__(self, base_url=LOCAL_URL, model=LOCAL_MODEL):
+        super().__init__(provider=None)
+        self.base_url = base_url
+        self.model = model
+
+    def default_model(self, model):
+        # Callers name hosted models; the local server only has the one it loaded
+        return self.model
+
+    def get_client(self):
+        if self.client is None:
+            self.client = AsyncInferenceClient(base_url=self.base_url, timeout=LOCAL_TIMEOUT)
+        return self.client
+
+
+def empty_json(prompt):
+    return "{}"
+
+
+class StubBackend:
+    """Answers with respond(prompt) after an optional simulated latency; usage is estimated like a provider's"""
+
+    STREAM_CHUNK = 16  # characters per streamed delta, roughly a few tokens
+
+    def __init__(self, respond=empty_json, latency=0.0):
+        self.respond = respond
+        self.latency = latency
+
+    def default_model(self, model):
+        return "stub"
+
+    async def create(self, model, prompt, max_tokens, temperature):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        text = self.respond(prompt)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=text))],
+            usage=SimpleNamespace(prompt_tokens=max(1, len(prompt) // 4), completion_tokens=max(1, len(text) // 4))
+        )
+
+    async def stream(self, model, prompt, max_tokens, temperature):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        text = self.respond(prompt)
+        for i in range(0, len(text), self.STREAM_CHUNK):
+            yield text[i:i + self.STREAM_CHUNK]
+
+
+backends = {
+    'remote': RemoteBackend(),
+    'local': LocalBackend(),
+    'stub': StubBackend(),
+}
+
+
+def register_backend(name, backend):
+    """Add or replace a backend, e.g. a StubBackend with scripted answers"""
+    backends[name] = backend
+
+
+def parse_routes(spec):
+    """'task=backend[:model],...' -> {task: (backend, model or None)}"""
+    routes = {}
+    for entry in filter(None, (part.strip() for part in (spec or '').split(','))):
+        task, _, target = entry.partition('=')
+        name, _, model = target.strip().partition(':')
+        routes[task.strip()] = (name, model or None)
+    return routes
+
+
+routes = parse_routes(os.environ.get("LLM_ROUTES"))
+
+
+def route(task, model):
+    """(backend name, backend, model) that should serve this task; model is the caller's default"""
+    name, routed_model = routes.get(task, (DEFAULT_BACKEND, None))
+    if name not in backends:
+        raise ValueError(f"Unknown LLM backend {name!r} for task {task!r}")
+    backend = backends[name]
+    return name, backend, routed_model or backend.default_model(model)
@@ -0,0 +1,267 @@
+"""
+Async LLM client with adaptive concurrency (AIMD), a circuit breaker and jittered backoff.
+Sync code (Flask handlers) calls it through complete(), which runs on a shared background event loop.
+Providers are llm_backend backends; for_task() returns the client for the backend a task is routed to.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+import json_stream
+import llm_backend
+import metrics
+
+INITIAL_CONCURRENCY = int(os.environ.get("LLM_INITIAL_CONCURRENCY", 4))
+MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 32))
+LATENCY_TARGET = float(os.environ.get("LLM_LATENCY_TARGET", 30.0))  # slower calls count as overload
+BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", 5))  # consecutive failures
+BREAKER_RESET = float(os.environ.get("LLM_BREAKER_RESET", 30.0))  # seconds open before a probe
+STREAM_JSON = os.environ.get("LLM_STREAM_JSON", "1").lower() not in ("0", "false", "no")
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 20.0
+RETRYABLE_CLIENT_ERRORS = (408, 429)  # other 4xx mean the request itself is wrong: resending can't help
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class AIMDLimiter:
+    """Concurrency limit: +1 per window of successes, halved on 429s or responses over the latency target"""
+
+    def __init__(self, service, initial=INITIAL_CONCURRENCY, minimum=1, maximum=MAX_CONCURRENCY,
+                 latency_target=LATENCY_TARGET, cooldown=2.0):
+        self.service = service
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.cooldown = cooldown  # one burst of 429s only halves the limit once
+        self.last_decrease = 0.0
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+        metrics.LLM_CONCURRENCY.set(int(self.limit), service)
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self, latency):
+        if latency > self.latency_target:
+            self.on_overload()
+            return
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        metrics.LLM_CONCURRENCY.set(int(self.limit), self.service)
+
+    def on_overload(self):
+        now = time.monotonic()
+        if now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+        metrics.LLM_CONCURRENCY.set(int(self.limit), self.service)
+        print(f"LLM concurrency limit lowered to {int(self.limit)}")
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, fails fast while open, lets one probe through after reset_timeout"""
+
+    def __init__(self, service, threshold=BREAKER_THRESHOLD, reset_timeout=BREAKER_RESET):
+        self.service = service
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = 'closed'
+        self.opened_at = 0.0
+
+    def allow(self):
+        if self.state == 'closed':
+            return True
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = 'half_open'
+            return True
+        return False  # open, or half-open with the probe still out
+
+    def record_success(self):
+        self.failures = 0
+        if self.state != 'closed':
+            print("LLM circuit closed")
+            self.state = 'closed'
+            metrics.LLM_CIRCUIT_OPEN.set(0, self.service)
+
+    def abandon_probe(self):
+        """The probe ended without a verdict (cancelled): let the next call probe again straight away"""
+        if self.state == 'half_open':
+            self.state = 'open'
+            self.opened_at = time.monotonic() - self.reset_timeout
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.threshold:
+            if self.state != 'open':
+                print(f"LLM circuit opened after {self.failures} failures")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            metrics.LLM_CIRCUIT_OPEN.set(1, self.service)
+
+
+def status_of(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) or getattr(response, 'status', None)
+
+
+def retry_after(error):
+    response = getattr(error, 'response', None)
+    value = getattr(response, 'headers', {}).get('Retry-After') if response is not None else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, error=None):
+    """Full-jitter exponential backoff, never shorter than the provider's Retry-After"""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    hint = retry_after(error) if error is not None else None
+    return max(delay, hint) if hint else delay
+
+
+# One event loop per process, on a daemon thread, shared by every client
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-client-loop", daemon=True).start()
+        return _loop
+
+
+def run_sync(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+
+class AsyncLLMClient:
+    def __init__(self, service, model, backend=None):
+        self.service = service
+        self.model = model
+        self.backend = backend or llm_backend.backends['remote']
+        self.limiter = None
+        self.breaker = CircuitBreaker(service)
+
+    async def chat(self, prompt, max_tokens=1000, temperature=0.1, retries=3):
+        """Returns (response_text, completion). Raises the last error, or CircuitOpenError"""
+        async def call():
+            completion = await self.backend.create(self.model, prompt, max_tokens, temperature)
+            return completion.choices[0].message.content.strip(), completion
+
+        return await self.with_retries(call, retries)
+
+    async def chat_json(self, prompt, max_tokens=1000, temperature=0.1, retries=3):
+        """Streams the answer and stops generation as soon as its first JSON object is complete.
+        Returns (response_text up to the object, None): there is no usage block, callers estimate tokens"""
+        async def call():
+            scanner = json_stream.JSONObjectScanner()
+            deltas = self.backend.stream(self.model, prompt, max_tokens, temperature)
+            try:
+                async for delta in deltas:
+                    if scanner.feed(delta) is not None:
+                        metrics.LLM_EARLY_STOPS.inc(self.service)
+                        break
+            finally:
+                await deltas.aclose()
+            text = scanner.text[:scanner.end] if scanner.done else scanner.text
+            return text.strip(), None
+
+        return await self.with_retries(call, retries)
+
+    async def with_retries(self, call, retries):
+        if self.limiter is None:
+            self.limiter = AIMDLimiter(self.service)
+
+        for attempt in range(retries):
+            if not self.breaker.allow():
+                metrics.LLM_CALLS.inc(self.service, 'circuit_open')
+                raise CircuitOpenError("LLM provider circuit is open, failing fast")
+            probe = self.breaker.state == 'half_open'  # allow() just let this call through as the probe
+            try:
+                await self.limiter.acquire()
+                start = time.perf_counter()
+                try:
+                    result = await call()
+                except Exception as e:
+                    error = e
+                else:
+                    error = None
+                finally:
+                    latency = time.perf_counter() - start
+                    await self.limiter.release()
+                metrics.STAGE_SECONDS.observe(latency, self.service, 'llm')
+
+                if error is None:
+                    self.limiter.on_success(latency)
+                    self.breaker.record_success()
+                    metrics.LLM_CALLS.inc(self.service, 'success')
+                    return result
+
+                status = status_of(error)
+                if status and 400 <= status < 500 and status not in RETRYABLE_CLIENT_ERRORS:
+                    # Bad request, auth or context-length errors: the provider is up, so no breaker failure either
+                    metrics.LLM_CALLS.inc(self.service, 'client_error')
+                    raise error
+                if status == 429:
+                    # Overload is a concurrency problem, not an outage: shrink the limit, leave the breaker alone
+                    self.limiter.on_overload()
+                    metrics.LLM_CALLS.inc(self.service, 'rate_limited')
+                    if probe:
+                        self.breaker.record_failure()  # no evidence of recovery: stay open for another timeout
+                else:
+                    self.breaker.record_failure()
+                    metrics.LLM_CALLS.inc(self.service, 'error')
+                print(f"Llama call attempt {attempt + 1} failed: {error}")
+
+                if attempt == retries - 1:
+                    raise error
+                wait_time = backoff_delay(attempt, error)
+                metrics.RETRIES.inc(self.service, 'llm')
+                await asyncio.sleep(wait_time)
+                metrics.STAGE_SECONDS.observe(wait_time, self.service, 'retry_sleep')
+            finally:
+                if probe:
+                    self.breaker.abandon_probe()
+
+    def complete(self, prompt, max_tokens=1000, temperature=0.1, retries=3):
+        """Blocking wrapper for sync callers"""
+        return run_sync(self.chat(prompt, max_tokens, temperature, retries))
+
+    def complete_json(self, prompt, max_tokens=1000, temperature=0.1, retries=3):
+        """Blocking wrapper for prompts that answer with a JSON object (streams unless LLM_STREAM_JSON=0)"""
+        if not STREAM_JSON:
+            return self.complete(prompt, max_tokens, temperature, retries)
+        return run_sync(self.chat_json(prompt, max_tokens, temperature, retries))
+
+
+# One client per (service, backend, model), so each backend gets its own limiter and breaker
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def for_task(service, task, model):
+    """Client for whichever backend serves this task; model is the service's default for remote calls"""
+    name, backend, routed_model = llm_backend.route(task, model)
+    key = (service, name, routed_model)
+    with _clients_lock:
+        if key not in _clients or _clients[key].backend is not backend:
+            _clients[key] = AsyncLLMClient(service, routed_model, backend)
+        return _clients[key]
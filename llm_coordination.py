@@ -0,0 +1,96 @@
+"""Coordination in front of call_llama: single-flight for identical calls, micro-batching for small ones"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Concurrent calls with the same key run fn once; the others wait and share its result"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        """Returns (result, shared) where shared is True for callers that waited on another"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from concurrent threads into batches of up to max_size,
+    waiting at most max_wait seconds for a batch to fill. The first submitter of each
+    batch runs batch_fn(items), which must return one result per item, in order.
+    """
+
+    def __init__(self, batch_fn, max_size=4, max_wait=0.05):
+        self.batch_fn = batch_fn
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.pending = None
+
+    def submit(self, item):
+        with self.lock:
+            batch = self.pending
+            leader = batch is None
+            if leader:
+                batch = self.pending = _Batch()
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self.max_size:
+                self.pending = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.max_wait)
+            with self.lock:
+                if self.pending is batch:
+                    self.pending = None
+            try:
+                batch.results = self.batch_fn(batch.items)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
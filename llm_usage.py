@@ -0,0 +1,158 @@
+"""LLM token accounting per endpoint and domain, with optional per-job token budgets"""
+import functools
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from flask import jsonify, request
+
+import metrics
+
+CHARS_PER_TOKEN = 4  # rough estimate when the provider sends no usage block
+DEFAULT_JOB_BUDGET = int(os.environ.get("LLM_JOB_TOKEN_BUDGET", 0))  # 0 = unlimited
+MAX_TOKENS_LIMIT = int(os.environ.get("LLM_MAX_TOKENS_LIMIT", 4000))  # cap on caller-chosen max_tokens
+
+# (service, endpoint, domain) -> {"requests": n, "prompt_tokens": n, "completion_tokens": n}
+usage = {}
+usage_lock = threading.Lock()
+
+_local = threading.local()
+
+
+class Job:
+    """One unit of work (an endpoint call for a domain) that LLM usage is attributed to"""
+
+    def __init__(self, endpoint, domain=None, budget=0):
+        self.endpoint = endpoint
+        self.domain = domain
+        self.budget = budget or 0
+        self.used = 0
+        self.calls = 0
+        self.budget_exceeded = False
+
+    def allows(self, prompt_tokens):
+        if not self.budget:
+            return True
+        if self.used + prompt_tokens > self.budget:
+            self.budget_exceeded = True
+        return not self.budget_exceeded
+
+    def charge(self, prompt_tokens, completion_tokens):
+        """Count one LLM call. Returns the [(job, prompt_tokens, completion_tokens)] to record usage under"""
+        self.used += prompt_tokens + completion_tokens
+        self.calls += 1
+        return [(self, prompt_tokens, completion_tokens)]
+
+    def summary(self):
+        return {
+            'llm_calls': self.calls,
+            'llm_tokens_used': self.used,
+            'token_budget': self.budget or None,
+            'budget_exceeded': self.budget_exceeded,
+        }
+
+
+class SharedJob:
+    """One LLM call made for several jobs (a micro-batch), its tokens split between them by weight.
+    Budgets are checked per member before the call, so the shared call itself is always allowed"""
+
+    def __init__(self, members):
+        self.members = [(member, weight) for member, weight in members]  # [(Job or None, weight)]
+
+    def allows(self, prompt_tokens):
+        return True
+
+    def charge(self, prompt_tokens, completion_tokens):
+        total = sum(weight for member, weight in self.members) or len(self.members)
+        shares = []
+        for member, weight in self.members:
+            share = (weight or 1) / total
+            member_prompt, member_completion = round(prompt_tokens * share), round(completion_tokens * share)
+            if member is not None:
+                member.charge(member_prompt, member_completion)
+            shares.append((member, member_prompt, member_completion))
+        return shares
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def current_job():
+    return getattr(_local, 'job', None)
+
+
+@contextmanager
+def job(endpoint, domain=None, budget=0):
+    with attached(Job(endpoint, domain, budget)) as current:
+        yield current
+
+
+@contextmanager
+def attached(current):
+    """Run LLM calls on this thread for an existing job, e.g. a batch leader working for other requests"""
+    previous = current_job()
+    _local.job = current
+    try:
+        yield current
+    finally:
+        _local.job = previous
+
+
+def check_budget(service, prompt):
+    """False once the current job's budget can't cover this prompt; callers then use their fallbacks"""
+    current = current_job()
+    if current is None or current.allows(estimate_tokens(prompt)):
+        return True
+    print(f"⛔ LLM token budget exceeded for {current.endpoint} ({current.used}/{current.budget})")
+    metrics.LLM_CALLS.inc(service, 'budget_exceeded')
+    return False
+
+
+def record(service, prompt, response_text, completion=None):
+    """Record prompt and completion tokens, from the usage block when there is one, else estimated"""
+    usage_block = getattr(completion, 'usage', None)
+    prompt_tokens = getattr(usage_block, 'prompt_tokens', None) or estimate_tokens(prompt)
+    completion_tokens = getattr(usage_block, 'completion_tokens', None) or estimate_tokens(response_text)
+
+    current = current_job()
+    shares = current.charge(prompt_tokens, completion_tokens) if current else [(None, prompt_tokens, completion_tokens)]
+    with usage_lock:
+        for charged, charged_prompt, charged_completion in shares:
+            key = (service, charged.endpoint if charged else None, charged.domain if charged else None)
+            entry = usage.setdefault(key, {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0})
+            entry['requests'] += 1
+            entry['prompt_tokens'] += charged_prompt
+            entry['completion_tokens'] += charged_completion
+
+    metrics.LLM_TOKENS.inc(service, 'prompt', amount=prompt_tokens)
+    metrics.LLM_TOKENS.inc(service, 'completion', amount=completion_tokens)
+
+
+def clamp_max_tokens(max_tokens):
+    return max(1, min(int(max_tokens), MAX_TOKENS_LIMIT))
+
+
+def tracked(endpoint, url_param='url'):
+    """Run a Flask view inside a job for the domain of its url parameter; ?token_budget=N sets a budget"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            url = request.args.get(url_param) or ''
+            domain = urlparse(url).netloc.lower() or None
+            budget = request.args.get('token_budget', type=int) or DEFAULT_JOB_BUDGET
+            with job(endpoint, domain, budget):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_endpoint(app):
+    """Add GET /llm-usage with totals per service, endpoint and domain"""
+    def usage_endpoint():
+        with usage_lock:
+            rows = [{'service': s, 'endpoint': e, 'domain': d, **counts} for (s, e, d), counts in usage.items()]
+        rows.sort(key=lambda r: r['prompt_tokens'] + r['completion_tokens'], reverse=True)
+        return jsonify({'usage': rows})
+    app.add_url_rule('/llm-usage', 'llm_usage', usage_endpoint, methods=['GET'])
@@ -0,0 +1,185 @@
+"""
+Collapse locale variants of the same page (/en/stores/x, /fr/boutiques/x, /es/tiendas/x) to one URL.
+
+Groups come from hreflang alternates (sitemap <xhtml:link> entries and HTML <link rel="alternate">), then from
+language path segments: URLs that differ only by the language segment, and finally URLs with the same last
+segment whose parent segments are known translations of each other (/en/stores/x, /fr/boutiques/x), as long as
+no language appears twice in a group.
+Each group is represented by its URL in the most preferred language; the alternates stay available.
+"""
+import os
+import re
+from urllib.parse import urljoin
+
+PREFERRED_LANGUAGES = [l.strip().lower() for l in os.environ.get("LOCALE_PREFERENCE", "en").split(',') if l.strip()]
+
+LANGUAGE_CODES = {
+    'ar', 'bg', 'ca', 'cs', 'cy', 'da', 'de', 'el', 'en', 'es', 'et', 'eu', 'fa', 'fi', 'fr', 'ga', 'gl', 'he',
+    'hi', 'hr', 'hu', 'id', 'is', 'it', 'ja', 'ko', 'lt', 'lv', 'ms', 'mt', 'nb', 'nl', 'nn', 'no', 'pl', 'pt',
+    'ro', 'ru', 'sk', 'sl', 'sr', 'sv', 'th', 'tr', 'uk', 'vi', 'zh',
+}
+LANGUAGE_SEGMENT = re.compile(r'^([a-z]{2})(?:[-_]([a-z]{2}|hans|hant))?$', re.IGNORECASE)
+MAX_LANGUAGE_DEPTH = 2  # /en/... or /mall-name/en/...
+
+# Section names that mean the same thing across languages; parents must match through this table to be grouped
+SECTION_TRANSLATIONS = {
+    'stores': ['stores', 'store', 'shops', 'shop', 'boutiques', 'boutique', 'magasins', 'tiendas', 'tienda',
+               'negozi', 'negozio', 'lojas', 'loja', 'geschaefte', 'geschafte', 'winkels', 'butiker', 'sklepy'],
+    'directory': ['directory', 'store-directory', 'annuaire', 'repertoire', 'directorio', 'verzeichnis',
+                  'elenco', 'diretorio', 'guide'],
+    'brands': ['brands', 'brand', 'marques', 'marque', 'marcas', 'marca', 'marken', 'marchi', 'merken'],
+    'dining': ['dining', 'restaurants', 'restaurant', 'restauration', 'restaurantes', 'ristoranti', 'gastronomie',
+               'food'],
+    'services': ['services', 'service', 'servicios', 'servizi', 'servicos', 'dienstleistungen', 'diensten'],
+}
+SECTION_CONCEPTS = {name: concept for concept, names in SECTION_TRANSLATIONS.items() for name in names}
+
+# origin, path, query: a cheaper urlsplit for the hundred-thousand-URL crawls we group
+URL_PARTS = re.compile(r'^([^:/?#]+://[^/?#]*)([^?#]*)(?:\?([^#]*))?')
+SITEMAP_URL_BLOCK = re.compile(r'<url>(.*?)</url>', re.DOTALL)
+SITEMAP_LOC = re.compile(r'<loc>(.*?)</loc>')
+SITEMAP_ALTERNATE = re.compile(r'<(?:xhtml:)?link\b[^>]*?hreflang="([^"]+)"[^>]*?href="([^"]+)"', re.IGNORECASE)
+
+
+def normalize_language(code):
+    return code.strip().lower().replace('_', '-')
+
+
+def split_url(url):
+    """(origin, path segments, query)"""
+    match = URL_PARTS.match(url)
+    if not match:
+        return '', [s for s in url.split('/') if s], ''
+    return match.group(1), [s for s in match.group(2).split('/') if s], match.group(3) or ''
+
+
+def find_language(segments):
+    """(index, language) of the language path segment, or None"""
+    for index, segment in enumerate(segments[:MAX_LANGUAGE_DEPTH]):
+        match = LANGUAGE_SEGMENT.match(segment)
+        if match and match.group(1).lower() in LANGUAGE_CODES:
+            return index, normalize_language(segment)
+    return None
+
+
+def language_segment(url):
+    return find_language(split_url(url)[1])
+
+
+def sitemap_alternates(content):
+    """[{language: url}] for each <url> in a sitemap that lists hreflang alternates"""
+    if 'hreflang' not in content:
+        return []
+    groups = []
+    for block in SITEMAP_URL_BLOCK.findall(content):
+        links = SITEMAP_ALTERNATE.findall(block)
+        if links:
+            group = {normalize_language(lang): href.strip() for lang, href in links}
+            loc = SITEMAP_LOC.search(block)
+            if loc and loc.group(1).strip() not in group.values():
+                found = language_segment(loc.group(1).strip())
+                group.setdefault(found[1] if found else '', loc.group(1).strip())
+            groups.append(group)
+    return groups
+
+
+def html_alternates(soup, base_url):
+    """{language: url} from <link rel="alternate" hreflang> tags (x-default included)"""
+    alternates = {}
+    for link in soup.find_all('link', hreflang=True, href=True):
+        rel = link.get('rel') or []
+        if 'alternate' in (rel if isinstance(rel, list) else rel.split()):
+            alternates[normalize_language(link['hreflang'])] = urljoin(base_url, link['href'])
+    return alternates
+
+
+def add_alternates(index, group):
+    """Record one hreflang group in index (url -> shared {language: url} dict), merging overlapping groups"""
+    merged = {}
+    for url in group.values():
+        merged.update(index.get(url, {}))
+    merged.update(group)
+    for url in merged.values():
+        index[url] = merged
+
+
+def preferred(group, preference):
+    for lang in preference:
+        for code, url in sorted(group.items()):
+            if code == lang or code.split('-')[0] == lang:
+                return url
+    if 'x-default' in group:
+        return group['x-default']
+    return group[min(group)]
+
+
+def group_urls(urls, alternates=None, preference=None):
+    """{representative url: {language: url}} covering every input URL exactly once, in input order.
+    URLs without locale variants map to {}"""
+    preference = preference or PREFERRED_LANGUAGES
+    alternates = alternates or {}
+    url_set = set(urls)
+    assigned = {}  # url -> group dict
+    groups = []
+
+    def new_group(members):
+        group = {}
+        for lang, url in members.items():
+            if url in url_set and url not in assigned:
+                group[lang] = url
+        if len(group) > 1:
+            for url in group.values():
+                assigned[url] = group
+            groups.append(group)
+
+    # 1. hreflang alternates, restricted to URLs we actually crawled
+    for url in urls:
+        if url in alternates and url not in assigned:
+            new_group(alternates[url])
+
+    # 2. Same path once the language segment is removed, 3. same slug under translated parent sections
+    exact, loose = {}, {}
+    for url in urls:
+        if url in assigned:
+            continue
+        origin, segments, query = split_url(url)
+        found = find_language(segments)
+        if not found:
+            continue
+        position, lang = found
+        rest = segments[:position] + segments[position + 1:]
+        exact.setdefault((origin, tuple(rest), query), {}).setdefault(lang, url)
+        if rest:
+            parents = tuple(SECTION_CONCEPTS.get(segment.lower(), segment) for segment in rest[:-1])
+            loose.setdefault((origin, position, parents, rest[-1], query), []).append((lang, url))
+    for members in exact.values():
+        if len(members) > 1:
+            new_group(members)
+    for members in loose.values():
+        members = [(lang, url) for lang, url in members if url not in assigned]
+        languages = [lang for lang, url in members]
+        if len(set(languages)) == len(languages) > 1:
+            new_group(dict(members))
+
+    representatives = {id(group): preferred(group, preference) for group in groups}
+    result = {}
+    for url in urls:
+        group = assigned.get(url)
+        if group is None:
+            result[url] = {}
+        elif representatives[id(group)] not in result:
+            result[representatives[id(group)]] = dict(group)
+    return result
+
+
+def alternate_roots(root, groups):
+    """{language: root} for a store root, from where the alternates of the stores under it live"""
+    votes = {}
+    for representative, group in groups.items():
+        if not representative.startswith(root) or representative == root:
+            continue
+        for lang, url in group.items():
+            parent = url[:url.rstrip('/').rfind('/') + 1]
+            votes.setdefault(lang, {}).setdefault(parent, 0)
+            votes[lang][parent] += 1
+    return {lang: max(parents, key=parents.get) for lang, parents in votes.items()}
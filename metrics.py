@@ -0,0 +1,164 @@
+"""In-process metrics shared by all services, exposed on /metrics in Prometheus text format"""
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+
+registry = []
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.values.items())
+        for labelvalues, value in items:
+            lines.append(f"{self.name}{format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.values = {}  # labelvalues -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self.lock:
+            state = self.values.get(labelvalues)
+            if state is None:
+                state = self.values[labelvalues] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted((k, list(v)) for k, v in self.values.items())
+        for labelvalues, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = format_labels(self.labelnames + ('le',), labelvalues + (repr(float(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labelnames + ('le',), labelvalues + ('+Inf',))
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            labels = format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {state[-2]}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def counter(name, help_text, labelnames=()):
+    metric = Counter(name, help_text, tuple(labelnames))
+    registry.append(metric)
+    return metric
+
+
+def gauge(name, help_text, labelnames=()):
+    metric = Gauge(name, help_text, tuple(labelnames))
+    registry.append(metric)
+    return metric
+
+
+def histogram(name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+    metric = Histogram(name, help_text, tuple(labelnames), buckets)
+    registry.append(metric)
+    return metric
+
+
+# Stages: fetch, html_parse, llm, json_extract, retry_sleep
+STAGE_SECONDS = histogram('mall_stage_duration_seconds', 'Time spent per pipeline stage', ('service', 'stage'))
+FETCH_BYTES = histogram('mall_fetch_bytes', 'Response body size per fetch', ('service',), BYTES_BUCKETS)
+FETCHES = counter('mall_fetches_total', 'HTTP fetches by status', ('service', 'status'))
+RETRIES = counter('mall_retries_total', 'Retries after a failed attempt', ('service', 'kind'))
+CACHE_REQUESTS = counter('mall_cache_requests_total', 'Cache lookups', ('service', 'cache', 'result'))
+LLM_CALLS = counter('mall_llm_calls_total', 'LLM calls by outcome', ('service', 'outcome'))
+LLM_TOKENS = counter('mall_llm_tokens_total', 'LLM tokens used', ('service', 'kind'))
+LLM_EARLY_STOPS = counter('mall_llm_early_stops_total', 'Streamed completions stopped once their JSON was complete',
+                          ('service',))
+URL_CLASSIFICATIONS = counter('mall_url_classifications_total', 'URLs labelled by the local classifier',
+                              ('service', 'task', 'result'))
+LLM_CONCURRENCY = gauge('mall_llm_concurrency_limit', 'Adaptive LLM concurrency limit', ('service',))
+LLM_CIRCUIT_OPEN = gauge('mall_llm_circuit_open', '1 while the LLM circuit breaker is open', ('service',))
+
+
+@contextmanager
+def stage(service, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, service, name)
+
+
+def timed_sleep(service, seconds):
+    """time.sleep that is accounted as the retry_sleep stage"""
+    time.sleep(seconds)
+    STAGE_SECONDS.observe(seconds, service, 'retry_sleep')
+
+
+def record_fetch(service, response):
+    FETCHES.inc(service, str(response.status_code))
+    FETCH_BYTES.observe(len(response.content), service)
+
+
+def record_cache(service, cache, hit):
+    CACHE_REQUESTS.inc(service, cache, 'hit' if hit else 'miss')
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def register_endpoint(app):
+    """Add GET /metrics to a Flask app"""
+    def metrics_endpoint():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint, methods=['GET'])
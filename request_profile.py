@@ -0,0 +1,181 @@
+"""
+Opt-in cProfile of single requests, for reproducing a slow mall in production.
+
+Enabled only when PROFILE_TOKEN is set. A request carrying `X-Profile-Token: <token>` (or `?profile=<token>`)
+runs its handler under cProfile; the response gets X-Profile-Id / X-Profile-Wall-Ms / X-Profile-Cpu-Ms headers
+and GET /profiles/<id> returns the wall/CPU breakdown, top functions and call tree (`?format=prof` for the
+pstats file, e.g. for snakeviz). Work on other threads (crawl workers, the LLM event loop) shows up as the
+handler's wait in Future.result / run_sync. Streamed responses are profiled up to the first byte only.
+Without the token, nothing is installed and requests run unchanged.
+"""
+import cProfile
+import hmac
+import inspect
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_DIR = os.environ.get("REQUEST_PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("REQUEST_PROFILE_KEEP", 50))
+TOP_FUNCTIONS = 40
+TREE_DEPTH = 6
+TREE_MIN_FRACTION = 0.01  # call tree hides branches under 1% of the handler's time
+
+# cProfile can't nest, and on newer Pythons only one profiler may run per process
+profile_lock = threading.Lock()
+
+
+def describe(func):
+    filename, line, name = func
+    return f"{name} ({os.path.basename(filename)}:{line})" if line else name
+
+
+def top_functions(stats, limit=TOP_FUNCTIONS):
+    rows = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        rows.append({'function': describe(func), 'calls': nc, 'self_s': round(tt, 4), 'cumulative_s': round(ct, 4)})
+    rows.sort(key=lambda r: r['cumulative_s'], reverse=True)
+    return rows[:limit]
+
+
+def call_tree(stats, root, total, depth=TREE_DEPTH):
+    """Nested {function, calls, cumulative_s, children} from root, built from pstats' caller records"""
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        for caller, (c_cc, c_nc, c_tt, c_ct) in callers.items():
+            callees.setdefault(caller, []).append((func, c_nc, c_ct))
+
+    def node(func, calls, cumulative, level, path):
+        entry = {'function': describe(func), 'calls': calls, 'cumulative_s': round(cumulative, 4)}
+        if level < depth:
+            children = sorted(callees.get(func, []), key=lambda c: c[2], reverse=True)
+            entry['children'] = [node(f, n, c, level + 1, path | {f}) for f, n, c in children
+                                 if c >= total * TREE_MIN_FRACTION and f not in path]
+        return entry
+
+    if root not in stats.stats:
+        return None
+    cc, nc, tt, ct, callers = stats.stats[root]
+    return node(root, nc, ct, 0, {root})
+
+
+def view_key(app, endpoint):
+    view = app.view_functions.get(endpoint)
+    if view is None:
+        return None
+    code = inspect.unwrap(view).__code__
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def prune(directory):
+    files = sorted((os.path.join(directory, f) for f in os.listdir(directory)), key=os.path.getmtime)
+    for path in files[:-PROFILE_KEEP * 2]:  # .json + .prof per request
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def stored_url(request):
+    """The request URL without the ?profile= token, which must not end up in readable reports"""
+    args = [(key, value) for key, value in request.args.items(multi=True) if key != 'profile']
+    return request.base_url + ('?' + urlencode(args) if args else '')
+
+
+def save(app, request, profiler, wall, cpu):
+    profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    directory = os.path.join(PROFILE_DIR, app.name)
+    os.makedirs(directory, exist_ok=True)
+    profiler.dump_stats(os.path.join(directory, profile_id + '.prof'))
+
+    stats = pstats.Stats(profiler)
+    root = view_key(app, request.endpoint)
+    report = {
+        'id': profile_id,
+        'service': app.name,
+        'endpoint': request.endpoint,
+        'url': stored_url(request),
+        'wall_s': round(wall, 4),
+        'cpu_s': round(cpu, 4),  # handler thread only
+        'wait_s': round(max(0.0, wall - cpu), 4),  # network, sleeps, other threads, LLM calls
+        'top': top_functions(stats),
+        'tree': call_tree(stats, root, wall) if root else None,
+    }
+    with open(os.path.join(directory, profile_id + '.json'), 'w') as f:
+        json.dump(report, f)
+    prune(directory)
+    return profile_id
+
+
+def register(app):
+    """Add per-request profiling and GET /profiles/<id> when PROFILE_TOKEN is set"""
+    if not PROFILE_TOKEN:
+        return
+    from flask import g, jsonify, request, send_file
+
+    def authorized():
+        token = request.headers.get('X-Profile-Token') or request.args.get('profile')
+        return token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+    def start_profile():
+        if 'X-Profile-Token' not in request.headers and 'profile' not in request.args:
+            return None
+        if not authorized():
+            return jsonify({'error': 'Invalid profile token'}), 403
+        if request.endpoint == 'request_profile':
+            return None
+        if not profile_lock.acquire(blocking=False):
+            g.profile_error = 'busy'
+            return None
+        g.profiler = cProfile.Profile()
+        g.profile_start = (time.perf_counter(), time.thread_time())
+        g.profiler.enable()
+        return None
+
+    def stop_profile():
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return None
+        profiler.disable()
+        profile_lock.release()
+        wall_start, cpu_start = g.pop('profile_start')
+        return profiler, time.perf_counter() - wall_start, time.thread_time() - cpu_start
+
+    def finish_profile(response):
+        stopped = stop_profile()
+        if stopped:
+            profiler, wall, cpu = stopped
+            response.headers['X-Profile-Id'] = save(app, request, profiler, wall, cpu)
+            response.headers['X-Profile-Wall-Ms'] = str(round(wall * 1000, 1))
+            response.headers['X-Profile-Cpu-Ms'] = str(round(cpu * 1000, 1))
+        elif 'profile_error' in g:
+            response.headers['X-Profile-Error'] = g.profile_error
+        return response
+
+    def abandon_profile(exc):
+        stop_profile()  # unhandled exception: after_request never ran
+
+    def profile_endpoint(profile_id):
+        if not authorized():
+            return jsonify({'error': 'Invalid profile token'}), 403
+        base = os.path.join(PROFILE_DIR, app.name, os.path.basename(profile_id))
+        if request.args.get('format') == 'prof':
+            if not os.path.exists(base + '.prof'):
+                return jsonify({'error': 'Unknown profile'}), 404
+            return send_file(os.path.abspath(base + '.prof'), mimetype='application/octet-stream',
+                             as_attachment=True, download_name=f"{profile_id}.prof")
+        try:
+            with open(base + '.json') as f:
+                return jsonify(json.load(f))
+        except FileNotFoundError:
+            return jsonify({'error': 'Unknown profile'}), 404
+
+    app.before_request(start_profile)
+    app.after_request(finish_profile)
+    app.teardown_request(abandon_profile)
+    app.add_url_rule('/profiles/<profile_id>', 'request_profile', profile_endpoint, methods=['GET'])
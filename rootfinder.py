@@ -3,26 +3,37 @@ import requests
 from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup
 import re
-import os
 import time
-import json
 from dotenv import load_dotenv
-from huggingface_hub import InferenceClient
+
+import http_fetch
+import json_stream
+import llm_client
+import llm_usage
+import metrics
+import request_profile
+import site_profile
 
 load_dotenv()
 app = Flask(__name__)
+metrics.register_endpoint(app)
+request_profile.register(app)
+llm_usage.register_endpoint(app)
 
-client = InferenceClient(
-    provider="fireworks-ai",
-    api_key=os.environ.get("HF_TOKEN"),
-)
+SERVICE = "rootfinder"
+LLAMA_MODEL = "meta-llama/Llama-3.1-8B-Instruct"
 
 def extract_sitemap_urls(url):
     urls = set()
     try:
-        res = requests.get(url, timeout=10)
+        with metrics.stage(SERVICE, 'fetch'):
+            res = http_fetch.fetch(requests.get, url, max_bytes=http_fetch.SITEMAP_MAX_BYTES,
+                                   allowed_types=http_fetch.SITEMAP_TYPES, timeout=10)
+        metrics.record_fetch(SERVICE, res)
         if res.status_code == 200:
-            found = re.findall(r"<loc>(.*?)</loc>", res.text)
+            body = http_fetch.gunzip_capped(res.content)
+            text = res.text if body is res.content else body.decode('utf-8', errors='replace')
+            found = re.findall(r"<loc>(.*?)</loc>", text)
             urls.update(found)
     except:
         pass
@@ -33,22 +44,45 @@ def crawl_site(homepage):
     base = f"{parsed.scheme}://{parsed.netloc}"
     urls = set()
 
-    # Try robots.txt
-    try:
-        robots = requests.get(urljoin(base, "/robots.txt")).text
-        sitemap_links = re.findall(r"sitemap:\s*(https?://[^\s]+)", robots, re.IGNORECASE)
-        for link in sitemap_links:
-            urls.update(extract_sitemap_urls(link))
-    except:
-        pass
+    known_sitemaps = site_profile.get_profile(homepage).get('sitemaps') or []
+    working_sitemaps = []
+
+    # Go straight to the sitemaps the site profile knows work
+    for link in known_sitemaps:
+        found = extract_sitemap_urls(link)
+        if found:
+            working_sitemaps.append(link)
+        urls.update(found)
+
+    if not working_sitemaps:
+        # Known sitemaps gone (or none yet): try robots.txt
+        sitemap_links = []
+        try:
+            with metrics.stage(SERVICE, 'fetch'):
+                robots = http_fetch.fetch(requests.get, urljoin(base, "/robots.txt"), max_bytes=512 * 1024,
+                                          timeout=10).text
+            sitemap_links = re.findall(r"sitemap:\s*(https?://[^\s]+)", robots, re.IGNORECASE)
+        except:
+            pass
+
+        # Try default sitemap
+        for link in sitemap_links + [urljoin(base, "/sitemap.xml"), urljoin(base, "/sitemap_index.xml")]:
+            found = extract_sitemap_urls(link)
+            if found and link not in working_sitemaps:
+                working_sitemaps.append(link)
+            urls.update(found)
 
-    # Try default sitemap
-    urls.update(extract_sitemap_urls(urljoin(base, "/sitemap.xml")))
-    urls.update(extract_sitemap_urls(urljoin(base, "/sitemap_index.xml")))
+    if working_sitemaps != known_sitemaps:
+        site_profile.update_profile(homepage, sitemaps=working_sitemaps or None)
 
     # Try homepage crawl
     try:
-        soup = BeautifulSoup(requests.get(homepage).text, "html.parser")
+        with metrics.stage(SERVICE, 'fetch'):
+            homepage_response = http_fetch.fetch(requests.get, homepage, allowed_types=http_fetch.HTML_TYPES,
+                                                 timeout=10)
+        metrics.record_fetch(SERVICE, homepage_response)
+        with metrics.stage(SERVICE, 'html_parse'):
+            soup = BeautifulSoup(homepage_response.text, "html.parser")
         for link in soup.find_all("a", href=True):
             full_url = urljoin(base, link["href"])
             if parsed.netloc in urlparse(full_url).netloc:
@@ -58,27 +92,23 @@ def crawl_site(homepage):
 
     return sorted(urls)
 
-def call_llama(prompt, max_tokens=400):
+def call_llama(prompt, max_tokens=400, task='store_root'):
+    if not llm_usage.check_budget(SERVICE, prompt):
+        return "Error calling LLaMA: token budget exceeded"
     try:
-        completion = client.chat.completions.create(
-            model="meta-llama/Llama-3.1-8B-Instruct",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=max_tokens,
-            temperature=0.1,
-        )
-        return completion.choices[0].message.content.strip()
+        llm = llm_client.for_task(SERVICE, task, LLAMA_MODEL)
+        response_text, completion = llm.complete_json(prompt, max_tokens, temperature=0.1, retries=1)
+        llm_usage.record(SERVICE, prompt, response_text, completion)
+        return response_text
     except Exception as e:
         return f"Error calling LLaMA: {str(e)}"
 
 def extract_json(text):
-    try:
-        json_start = text.find('{')
-        json_end = text.rfind('}') + 1
-        return json.loads(text[json_start:json_end])
-    except:
-        return None
+    with metrics.stage(SERVICE, 'json_extract'):
+        return json_stream.extract_json(text)
 
 @app.route("/find-store-root", methods=["GET"])
+@llm_usage.tracked('find_store_root')
 def find_store_root():
     homepage = request.args.get("url")
     if not homepage:
@@ -102,6 +132,8 @@ Return:
 
     llama_response = call_llama(prompt)
     parsed = extract_json(llama_response)
+    if parsed and isinstance(parsed.get("store_roots"), str) and parsed["store_roots"].startswith("http"):
+        site_profile.update_profile(homepage, store_root_candidate=parsed["store_roots"])
 
     return jsonify({
         "homepage": homepage,
@@ -1,48 +1,101 @@
 from flask import Flask, request, jsonify
 import requests
 from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
 import time
 import re
 import os
-from huggingface_hub import InferenceClient
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 
+import http_fetch
+import llm_usage
+import metrics
+import request_profile
+import llm_client
+
 load_dotenv()
 app = Flask(__name__)
+metrics.register_endpoint(app)
+request_profile.register(app)
+llm_usage.register_endpoint(app)
+
+SERVICE = "searchmall"
 
-client = InferenceClient(
-    provider="fireworks-ai",
-    api_key=os.environ.get("HF_TOKEN"),
-)
+LLAMA_MODEL = "meta-llama/Llama-4-Maverick-17B-128E-Instruct"
 
 DUCKDUCKGO_SEARCH_URL = "https://html.duckduckgo.com/html/"
+SEARCH_TIMEOUT = 10
+SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", 7 * 24 * 3600))
+SEARCH_MIN_INTERVAL = float(os.environ.get("SEARCH_MIN_INTERVAL", 1.0))  # per process, shared by its threads
+BULK_MAX_WORKERS = 8
+# Uncached searches are serialized at SEARCH_MIN_INTERVAL, so a bulk request takes about this many seconds
+# cold: keep it inside the request timeout and send bigger lists in several requests
+BULK_MAX_PAIRS = int(os.environ.get("BULK_MAX_PAIRS", 100))
 
+session = requests.Session()
+session.headers.update({'User-Agent': 'Mozilla/5.0'})
 
-def call_llama(prompt, max_tokens=500, temperature=0.1, retries=3):
-    for attempt in range(retries):
-        try:
-            completion = client.chat.completions.create(
-                model="meta-llama/Llama-4-Maverick-17B-128E-Instruct",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=max_tokens,
-                temperature=temperature
-            )
-            return completion.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"Llama call failed (attempt {attempt + 1}): {e}")
-            if attempt < retries - 1:
-                time.sleep((attempt + 1) * 2)
-            else:
-                return None
+# Search cache: normalized query -> (timestamp, results)
+search_cache = {}
+search_cache_lock = threading.Lock()
+
+# Rate limiting globals
+rate_limit_lock = threading.Lock()
+last_search_time = 0
+
+# Candidate verification: all fetches share one deadline, the budget of a single sequential fetch
+VERIFY_TOP_N = 3
+VERIFY_TIMEOUT = 8
+VERIFY_MAX_BYTES = 256 * 1024
+VERIFY_CACHE_TTL = int(os.environ.get("VERIFY_CACHE_TTL", 7 * 24 * 3600))
+VERIFY_CACHED_FAILURES = (404, 410)
+DIRECTORY_LINK_KEYWORDS = ['store', 'shop', 'directory', 'boutique', 'tienda', 'magasin', 'negozi', 'loja', 'brand']
+
+# Verification cache: domain -> (timestamp, page signals)
+verify_cache = {}
+verify_cache_lock = threading.Lock()
+verify_executor = ThreadPoolExecutor(max_workers=16)
+
+
+def call_llama(prompt, max_tokens=500, temperature=0.1, retries=3, task='homepage_pick'):
+    if not llm_usage.check_budget(SERVICE, prompt):
+        return None
+    try:
+        llm = llm_client.for_task(SERVICE, task, LLAMA_MODEL)
+        response_text, completion = llm.complete(prompt, max_tokens, temperature, retries)
+    except Exception as e:
+        print(f"Llama call failed: {e}")
+        return None
+    llm_usage.record(SERVICE, prompt, response_text, completion)
+    return response_text
+
+
+def rate_limit():
+    """Space out DuckDuckGo requests from all threads by SEARCH_MIN_INTERVAL"""
+    global last_search_time
+    with rate_limit_lock:
+        delay = SEARCH_MIN_INTERVAL - (time.time() - last_search_time)
+        if delay > 0:
+            time.sleep(delay)
+        last_search_time = time.time()
+
+
+def normalize_query(query):
+    """Lowercase, drop punctuation and collapse whitespace so equivalent queries share a cache entry"""
+    query = re.sub(r'[^\w\s]', ' ', query.lower())
+    return re.sub(r'\s+', ' ', query).strip()
 
 
 def search_duckduckgo(query, max_results=10):
+    rate_limit()
     try:
-        response = requests.post(DUCKDUCKGO_SEARCH_URL, data={'q': query}, headers={
-            'User-Agent': 'Mozilla/5.0'
-        })
-        soup = BeautifulSoup(response.text, 'html.parser')
+        with metrics.stage(SERVICE, 'fetch'):
+            response = session.post(DUCKDUCKGO_SEARCH_URL, data={'q': query}, timeout=SEARCH_TIMEOUT)
+        metrics.record_fetch(SERVICE, response)
+        with metrics.stage(SERVICE, 'html_parse'):
+            soup = BeautifulSoup(response.text, 'html.parser')
         results = []
         for a in soup.find_all('a', class_='result__a', href=True):
             url = a['href']
@@ -56,6 +109,24 @@ def search_duckduckgo(query, max_results=10):
         return []
 
 
+def cached_search(query, max_results=10):
+    """Search with a TTL cache keyed by normalized query. Returns (results, cache_hit)"""
+    key = normalize_query(query)
+    now = time.time()
+    with search_cache_lock:
+        entry = search_cache.get(key)
+    if entry and now - entry[0] < SEARCH_CACHE_TTL:
+        metrics.record_cache(SERVICE, 'search', True)
+        return entry[1][:max_results], True
+    metrics.record_cache(SERVICE, 'search', False)
+
+    results = search_duckduckgo(query, max_results)
+    if results:  # don't cache failures, so a re-run retries them
+        with search_cache_lock:
+            search_cache[key] = (now, results)
+    return results, False
+
+
 def score_results(results, mall_name):
     scored = []
     for title, url in results:
@@ -73,29 +144,251 @@ def score_results(results, mall_name):
     return sorted(scored, key=lambda x: x['score'], reverse=True)
 
 
+def fetch_page_signals(url, deadline):
+    """HEAD then a capped GET of a candidate; returns page signals or None if unreachable"""
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        return None
+    head = session.head(url, allow_redirects=True, timeout=remaining)
+    # Some servers reject HEAD outright, let the GET decide for those
+    if head.status_code >= 400 and head.status_code not in (403, 405, 501):
+        return {'reachable': False, 'status': head.status_code}
+    content_type = head.headers.get('Content-Type', '')
+    if head.ok and content_type and 'html' not in content_type:
+        return {'reachable': False, 'status': head.status_code, 'content_type': content_type}
+
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        return None
+    with session.get(head.url if head.ok else url, stream=True, timeout=remaining,
+                     headers={'Accept-Encoding': http_fetch.ACCEPT_ENCODING}) as response:
+        if response.status_code != 200:
+            return {'reachable': False, 'status': response.status_code}
+        body = b''
+        for chunk in response.iter_content(chunk_size=16384):
+            body += chunk
+            if len(body) >= VERIFY_MAX_BYTES or time.time() > deadline:
+                break
+        final_url = response.url
+        encoding = response.encoding or 'utf-8'
+
+    metrics.FETCH_BYTES.observe(len(body), SERVICE)
+    with metrics.stage(SERVICE, 'html_parse'):
+        soup = BeautifulSoup(body.decode(encoding, errors='replace'), 'html.parser')
+    title = soup.title.get_text(strip=True) if soup.title else ''
+    canonical = soup.find('link', rel='canonical', href=True)
+    directory_links = set()
+    has_sitemap_link = False
+    for a in soup.find_all('a', href=True):
+        href = a['href'].lower()
+        text = a.get_text(strip=True).lower()
+        if 'sitemap' in href:
+            has_sitemap_link = True
+        if any(kw in href or kw in text for kw in DIRECTORY_LINK_KEYWORDS):
+            directory_links.add(href)
+
+    return {
+        'reachable': True,
+        'final_url': final_url,
+        'title': title,
+        'canonical': canonical['href'] if canonical else None,
+        'directory_links': len(directory_links),
+        'has_sitemap': has_sitemap_link,
+    }
+
+
+def probe_sitemap(url, deadline):
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        return False
+    response = session.head(urljoin(url, '/sitemap.xml'), allow_redirects=True, timeout=remaining)
+    return response.status_code == 200
+
+
+def score_page_signals(signals, mall_name):
+    if not signals or not signals.get('reachable'):
+        return -3
+    score = 0
+    mall_key = re.sub(r'[^\w]', '', mall_name.lower())
+    if mall_key and mall_key in re.sub(r'[^\w]', '', signals['title'].lower()):
+        score += 2
+    if signals['canonical']:
+        # A canonical pointing at another site means we are looking at a listing of the mall, not the mall
+        canonical_domain = urlparse(urljoin(signals['final_url'], signals['canonical'])).netloc.lower()
+        final_domain = urlparse(signals['final_url']).netloc.lower()
+        score += 2 if canonical_domain.removeprefix('www.') == final_domain.removeprefix('www.') else -2
+    if signals['directory_links'] >= 3:
+        score += 3
+    elif signals['directory_links']:
+        score += 1
+    if signals['has_sitemap']:
+        score += 1
+    return score
+
+
+def verify_candidates(ranked, mall_name, top_n=VERIFY_TOP_N):
+    """Fetch the top candidates in parallel and re-rank them on page signals, cached per domain"""
+    deadline = time.time() + VERIFY_TIMEOUT
+    candidates = ranked[:top_n]
+    now = time.time()
+
+    futures = {}
+    signals_by_domain = {}
+    for candidate in candidates:
+        domain = urlparse(candidate['url']).netloc.lower()
+        if domain in signals_by_domain or domain in futures:
+            continue
+        with verify_cache_lock:
+            entry = verify_cache.get(domain)
+        if entry and now - entry[0] < VERIFY_CACHE_TTL:
+            metrics.record_cache(SERVICE, 'verify', True)
+            signals_by_domain[domain] = entry[1]
+            continue
+        metrics.record_cache(SERVICE, 'verify', False)
+        futures[domain] = (
+            verify_executor.submit(fetch_page_signals, candidate['url'], deadline),
+            verify_executor.submit(probe_sitemap, candidate['url'], deadline),
+        )
+
+    if futures:
+        wait([f for pair in futures.values() for f in pair], timeout=max(0, deadline - time.time()))
+
+    for domain, (page_future, sitemap_future) in futures.items():
+        if not page_future.done():
+            # Out of budget: leave uncached so the next lookup tries again
+            signals_by_domain[domain] = None
+            continue
+        try:
+            signals = page_future.result()
+        except Exception as e:
+            print(f"Verification error for {domain}: {e}")
+            signals = {'reachable': False}
+        if signals and signals.get('reachable') and sitemap_future.done() and not sitemap_future.exception():
+            signals['has_sitemap'] = signals['has_sitemap'] or sitemap_future.result()
+        signals_by_domain[domain] = signals
+        # Only definitive answers are cached: timeouts, resets and 5xx get another try next lookup
+        if signals is not None and (signals.get('reachable') or signals.get('status') in VERIFY_CACHED_FAILURES):
+            with verify_cache_lock:
+                verify_cache[domain] = (now, signals)
+
+    verified = []
+    for candidate in candidates:
+        signals = signals_by_domain.get(urlparse(candidate['url']).netloc.lower())
+        page_score = score_page_signals(signals, mall_name) if signals is not None else 0
+        verified.append({
+            **candidate,
+            'page_score': page_score,
+            'verified_score': candidate['score'] + page_score,
+            'verification': signals,
+        })
+    verified.sort(key=lambda x: x['verified_score'], reverse=True)
+    return verified + ranked[top_n:]
+
+
+def pick_top(ranked):
+    if not ranked:
+        return None
+    top = ranked[0]
+    return top if top.get('verified_score', top['score']) >= 3 else None
+
+
+def resolve_homepage(mall, address, verify=False):
+    """Search for a mall and rank the results. Returns (query, ranked, cache_hit)"""
+    query = f"{mall} {address}"
+    results, cache_hit = cached_search(query)
+    ranked = score_results(results, mall)
+    if verify and ranked:
+        ranked = verify_candidates(ranked, mall)
+    return query, ranked, cache_hit
+
+
 @app.route('/find-homepage', methods=['GET'])
 def find_homepage():
     mall = request.args.get('mall')
     address = request.args.get('address')
+    verify = request.args.get('verify', '').lower() in ('1', 'true', 'yes')
 
     if not mall or not address:
         return jsonify({'error': 'Missing mall or address parameter'}), 400
 
-    query = f"{mall} {address}"
-    results = search_duckduckgo(query)
-    if not results:
+    query, ranked, _ = resolve_homepage(mall, address, verify=verify)
+    if not ranked:
         return jsonify({'homepage': None, 'reason': 'No search results'})
 
-    ranked = score_results(results, mall)
-    top = ranked[0] if ranked and ranked[0]['score'] >= 3 else None
+    top = pick_top(ranked)
 
     return jsonify({
         'query': query,
         'homepage': top['url'] if top else None,
-        'confidence_score': top['score'] if top else 0,
+        'confidence_score': top.get('verified_score', top['score']) if top else 0,
         'top_candidates': ranked[:3]
     })
 
 
+@app.route('/find-homepages', methods=['POST'])
+def find_homepages():
+    """
+    Bulk homepage search
+    Expected: POST /find-homepages {"malls": [{"mall": "...", "address": "..."}, ...], "verify": false}
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('malls'), list):
+        return jsonify({'error': 'Missing malls list in request body'}), 400
+    verify = bool(data.get('verify', False))
+
+    pairs = data['malls']
+    if len(pairs) > BULK_MAX_PAIRS:
+        return jsonify({'error': f'Too many malls (max {BULK_MAX_PAIRS})'}), 400
+
+    def check(pair):
+        if not isinstance(pair, dict):
+            return {'mall': None, 'address': None, 'error': 'Each entry must be an object with mall and address'}
+        mall = pair.get('mall')
+        address = pair.get('address')
+        if not mall or not address:
+            return {'mall': mall, 'address': address, 'error': 'Missing mall or address'}
+        if not isinstance(mall, str) or not isinstance(address, str):
+            return {'mall': mall, 'address': address, 'error': 'mall and address must be strings'}
+        return None
+
+    def lookup_key(pair):
+        # Entries that normalize to the same query and score against the same mall name share one lookup
+        return normalize_query(f"{pair['mall']} {pair['address']}"), pair['mall'].lower().replace(" ", "")
+
+    lookups = {}
+    for pair in pairs:
+        if check(pair) is None:
+            lookups.setdefault(lookup_key(pair), pair)
+
+    with ThreadPoolExecutor(max_workers=BULK_MAX_WORKERS) as executor:
+        futures = {key: executor.submit(resolve_homepage, pair['mall'], pair['address'], verify)
+                   for key, pair in lookups.items()}
+        resolved = {key: future.result() for key, future in futures.items()}
+
+    results = []
+    for pair in pairs:
+        error = check(pair)
+        if error:
+            results.append(error)
+            continue
+        query, ranked, cache_hit = resolved[lookup_key(pair)]
+        top = pick_top(ranked)
+        results.append({
+            'mall': pair['mall'],
+            'address': pair['address'],
+            'query': query,
+            'homepage': top['url'] if top else None,
+            'confidence_score': top.get('verified_score', top['score']) if top else 0,
+            'ranked': ranked,
+            'cached': cache_hit
+        })
+
+    return jsonify({
+        'total': len(results),
+        'cache_hits': sum(1 for r in results if r.get('cached')),
+        'results': results
+    })
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5003, debug=True)
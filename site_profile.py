@@ -0,0 +1,102 @@
+"""
+Per-domain site profiles, persisted as one JSON file per domain, so each run starts from what
+earlier runs learned about a site instead of re-paying for strategies that are known to fail.
+
+Fields written by the services:
+  tls_mode      "default" or "relaxed" (needs the SECLEVEL=1 TLSAdapter)
+  render_mode   "requests" or "playwright" (plain requests are blocked or get no content)
+  plain_failures     consecutive plain-request failures, before render_mode switches to "playwright"
+  render_checked_at  when a "playwright" domain last tried plain requests again
+  sitemaps      sitemap URLs that returned page URLs
+  sitemap_path  sitemap location found by probing (crawlerai)
+  store_roots   store roots confirmed by find_store_roots
+  store_root_candidate  store root picked by rootfinder
+"""
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+PROFILE_DIR = os.environ.get("SITE_PROFILE_DIR", "site_profiles")
+PROFILE_MAX_AGE = int(os.environ.get("SITE_PROFILE_MAX_AGE", 30 * 24 * 3600))  # older profiles are re-learned
+
+profiles = {}  # domain -> (file mtime, profile); other services write the same files
+profiles_lock = threading.Lock()
+
+
+def domain_of(url_or_domain):
+    netloc = urlparse(url_or_domain).netloc if '://' in url_or_domain else url_or_domain
+    netloc = netloc.lower()
+    return netloc[4:] if netloc.startswith('www.') else netloc
+
+
+def profile_path(domain):
+    safe_name = ''.join(c if c.isalnum() or c in '.-' else '_' for c in domain)
+    return os.path.join(PROFILE_DIR, f"{safe_name}.json")
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _load(domain):
+    """The domain's profile, re-read from disk whenever another process has rewritten the file"""
+    path = profile_path(domain)
+    mtime = _mtime(path)
+    entry = profiles.get(domain)
+    if entry and entry[0] == mtime:
+        return entry[1]
+    profile = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        pass
+    profiles[domain] = (mtime, profile)
+    return profile
+
+
+def get_profile(url_or_domain):
+    """A copy of the domain's profile, or {} if there is none or it is too old"""
+    domain = domain_of(url_or_domain)
+    if not domain:
+        return {}
+    with profiles_lock:
+        profile = _load(domain)
+        if profile and time.time() - profile.get('updated_at', 0) > PROFILE_MAX_AGE:
+            return {}
+        return dict(profile)
+
+
+def update_profile(url_or_domain, **fields):
+    """Merge fields into the domain's profile and write it to disk. A None value removes the field"""
+    domain = domain_of(url_or_domain)
+    if not domain:
+        return
+    with profiles_lock:
+        profile = _load(domain)
+        changed = False
+        for key, value in fields.items():
+            if value is None:
+                changed |= profile.pop(key, None) is not None
+            elif profile.get(key) != value:
+                profile[key] = value
+                changed = True
+        if not changed and time.time() - profile.get('updated_at', 0) < PROFILE_MAX_AGE / 2:
+            return
+        profile['domain'] = domain
+        profile['updated_at'] = time.time()
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = profile_path(domain)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(profile, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, path)
+            profiles[domain] = (_mtime(path), profile)
+        except OSError as e:
+            print(f"Could not save site profile for {domain}: {e}")
@@ -1,20 +1,47 @@
 from flask import Flask, request, jsonify
 from bs4 import BeautifulSoup
-from huggingface_hub import InferenceClient
 import requests
+from urllib.parse import urlparse
 import asyncio
 import os
-import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from playwright.async_api import async_playwright
 
+import content_extract
+import http_fetch
+import json_stream
+import llm_client
+import llm_usage
+import metrics
+import request_profile
+import site_profile
+
 load_dotenv()
 
 app = Flask(__name__)
-client = InferenceClient(
-    provider="fireworks-ai",
-    api_key=os.environ.get("HF_TOKEN"),
-)
+metrics.register_endpoint(app)
+request_profile.register(app)
+llm_usage.register_endpoint(app)
+
+SERVICE = "storeinfo"
+LLAMA_MODEL = "meta-llama/Llama-3.1-8B-Instruct"
+
+PROBE_TIMEOUT = 10
+PROBE_CACHE_TTL = int(os.environ.get("PROBE_CACHE_TTL", 6 * 3600))
+PROBE_CACHED_FAILURES = (404, 410)
+PROBE_MAX_WORKERS = 16
+BULK_MAX_URLS = 5000
+RENDER_SWITCH_FAILURES = 3  # consecutive plain-request failures before a domain goes straight to Playwright
+RENDER_RECHECK = 24 * 3600  # how often a Playwright domain tries plain requests again
+
+session = requests.Session()
+
+# Probe cache: url -> (timestamp, result)
+probe_cache = {}
+probe_cache_lock = threading.Lock()
 
 async def render_js_content(url):
     try:
@@ -30,43 +57,65 @@ async def render_js_content(url):
 
 def extract_html_content(url):
     try:
-        res = requests.get(url, timeout=10)
+        with metrics.stage(SERVICE, 'fetch'):
+            res = http_fetch.fetch(requests.get, url, allowed_types=http_fetch.HTML_TYPES, timeout=10)
+        metrics.record_fetch(SERVICE, res)
         if res.status_code == 200:
             return res.text
     except:
         return None
     return None
 
-def extract_text_from_html(html):
-    soup = BeautifulSoup(html, "html.parser")
-    [s.extract() for s in soup(["script", "style"])]
-    return soup.get_text(separator=" ", strip=True)
+def extract_text_from_html(html, budget=5000, site=None, page=None):
+    with metrics.stage(SERVICE, 'html_parse'):
+        soup = BeautifulSoup(html, "html.parser")
+        [s.extract() for s in soup(["script", "style", "noscript", "iframe"])]
+        return content_extract.select_main_content(soup, budget, site=site, page=page)
 
-def call_llama(prompt):
+def call_llama(prompt, task='store_info'):
+    if not llm_usage.check_budget(SERVICE, prompt):
+        return "Error calling LLaMA: token budget exceeded"
     try:
-        response = client.chat.completions.create(
-            model="meta-llama/Llama-3.1-8B-Instruct",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.1,
-            max_tokens=400,
-        )
-        return response.choices[0].message.content.strip()
+        llm = llm_client.for_task(SERVICE, task, LLAMA_MODEL)
+        response_text, response = llm.complete_json(prompt, max_tokens=400, temperature=0.1, retries=1)
+        llm_usage.record(SERVICE, prompt, response_text, response)
+        return response_text
     except Exception as e:
         return f"Error calling LLaMA: {str(e)}"
 
 @app.route("/store-info", methods=["GET"])
+@llm_usage.tracked('store_info')
 def store_info():
     url = request.args.get("url")
     if not url:
         return jsonify({"error": "Missing 'url' parameter"}), 400
 
-    html = extract_html_content(url)
-    if not html:
-        html = asyncio.run(render_js_content(url))
+    # Sites known to block plain requests go straight to Playwright, re-checking plain requests once a day
+    profile = site_profile.get_profile(url)
+    render_mode = profile.get('render_mode')
+    try_plain = render_mode != 'playwright' or time.time() - profile.get('render_checked_at', 0) >= RENDER_RECHECK
+    html = extract_html_content(url) if try_plain else None
+    if html:
+        if render_mode != 'requests' or profile.get('plain_failures'):
+            site_profile.update_profile(url, render_mode='requests', plain_failures=None, render_checked_at=None)
+    else:
+        if render_mode == 'playwright':
+            if try_plain:
+                site_profile.update_profile(url, render_checked_at=time.time())
+        elif try_plain:
+            # One timeout is not a blocked site: switch only after repeated failures
+            failures = profile.get('plain_failures', 0) + 1
+            if failures >= RENDER_SWITCH_FAILURES:
+                site_profile.update_profile(url, render_mode='playwright', plain_failures=None,
+                                            render_checked_at=time.time())
+            else:
+                site_profile.update_profile(url, plain_failures=failures)
+        with metrics.stage(SERVICE, 'render'):
+            html = asyncio.run(render_js_content(url))
         if not html:
             return jsonify({"error": "Failed to fetch page content."}), 500
 
-    text = extract_text_from_html(html)[:5000]  # Keep within token limit
+    text = extract_text_from_html(html, 5000, site=urlparse(url).netloc.lower(), page=url)  # Keep within token limit
 
     prompt = f"""
 RESPOND IN JSON ONLY. NO EXPLANATION.
@@ -86,11 +135,49 @@ TEXT:
 """
 
     response = call_llama(prompt)
+    with metrics.stage(SERVICE, 'json_extract'):
+        extracted = json_stream.extract_json(response)
+    return jsonify(extracted) if extracted is not None else jsonify({"error": "No JSON returned", "raw": response})
+
+
+def probe_url(url):
+    """Status and final location of a URL: HEAD first, then a one-byte ranged GET. Cached per URL"""
+    now = time.time()
+    with probe_cache_lock:
+        entry = probe_cache.get(url)
+    if entry and now - entry[0] < PROBE_CACHE_TTL:
+        metrics.record_cache(SERVICE, 'probe', True)
+        return {**entry[1], 'cached': True}
+    metrics.record_cache(SERVICE, 'probe', False)
+
+    result = {'url': url, 'status': None, 'final_url': None, 'ok': False}
     try:
-        match = re.search(r'\{.*\}', response, re.DOTALL)
-        return jsonify(eval(match.group(0))) if match else jsonify({"error": "No JSON returned"})
-    except Exception as e:
-        return jsonify({"error": str(e), "raw": response}), 500
+        with metrics.stage(SERVICE, 'probe'):
+            try:
+                response = session.head(url, allow_redirects=True, timeout=PROBE_TIMEOUT)
+                status = response.status_code
+            except requests.exceptions.RequestException:
+                status = None
+            # Servers that reject or mishandle HEAD get a GET that stops after the headers
+            if status is None or status in (403, 405, 501):
+                with session.get(url, allow_redirects=True, timeout=PROBE_TIMEOUT, stream=True,
+                                 headers={'Range': 'bytes=0-0', 'Accept-Encoding': http_fetch.ACCEPT_ENCODING}) as response:
+                    status = response.status_code
+        metrics.FETCHES.inc(SERVICE, str(status))
+        result['status'] = 200 if status == 206 else status
+        result['final_url'] = response.url
+        result['ok'] = result['status'] == 200
+    except requests.exceptions.RequestException as e:
+        print(f"Request failed: {e}")
+        result['error'] = str(e)[:200]
+        return {**result, 'cached': False}  # transient, don't cache
+
+    # Only definitive answers are cached: 5xx, 429 and the like may clear up on the next check
+    status = result['status']
+    if status is not None and (200 <= status < 400 or status in PROBE_CACHED_FAILURES):
+        with probe_cache_lock:
+            probe_cache[url] = (now, result)
+    return {**result, 'cached': False}
 
 
 @app.route('/check-url', methods=['GET'])
@@ -100,15 +187,39 @@ def check_url():
     if not url:
         return jsonify({'error': 'Missing url parameter'}), 400
 
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            return jsonify({'result': url})
-        else:
-            return jsonify({'result': ''})
-    except requests.exceptions.RequestException as e:
-        print(f"Request failed: {e}")
-        return jsonify({'result': ''})
+    result = probe_url(url)
+    return jsonify({'result': url if result['ok'] else ''})
+
+
+@app.route('/check-urls', methods=['POST'])
+def check_urls():
+    """
+    Bulk URL check
+    Expected: POST /check-urls {"urls": ["https://mall.example/stores/a", ...]}
+    """
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('urls'), list):
+        return jsonify({'error': 'Missing urls list in request body'}), 400
+
+    urls = data['urls']
+    if len(urls) > BULK_MAX_URLS:
+        return jsonify({'error': f'Too many urls (max {BULK_MAX_URLS})'}), 400
+
+    def check(url):
+        if not isinstance(url, str) or not url:
+            return {'url': url, 'status': None, 'final_url': None, 'ok': False, 'cached': False,
+                    'error': 'Each entry must be a non-empty URL string'}
+        return probe_url(url)
+
+    with ThreadPoolExecutor(max_workers=PROBE_MAX_WORKERS) as executor:
+        results = list(executor.map(check, urls))
+
+    return jsonify({
+        'total': len(results),
+        'ok_urls': [r['url'] for r in results if r['ok']],
+        'cache_hits': sum(1 for r in results if r['cached']),
+        'results': results
+    })
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
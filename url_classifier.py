@@ -0,0 +1,330 @@
+"""
+URL classifier distilled from the LLM's own decisions, so most sites are labelled without an LLM call.
+
+find_directory_pages and find_store_roots log the LLM's verdicts (url, label) to URL_CLASSIFIER_DIR/labels.jsonl:
+directory (a page listing stores) or store_root (a path store pages are built under), against noise.
+`python -m url_classifier train` (or POST /url-classifier/train) fits a logistic regression per task on hashed
+path features: byte 3-5-grams, path segments, depth and slug shape. The host is left out so the model
+carries over to sites it has never seen. The services load model.npz in-process, score URLs in batches and
+only send the LLM the URLs the model is unsure about (neither side of URL_CLASSIFIER_CONFIDENCE).
+The two tasks get separate models because the same URL (/en/stores/) is often both.
+"""
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from itertools import chain
+from urllib.parse import urlsplit
+
+import numpy as np
+
+import metrics
+
+CLASSIFIER_DIR = os.environ.get("URL_CLASSIFIER_DIR", "url_classifier")
+CONFIDENCE = float(os.environ.get("URL_CLASSIFIER_CONFIDENCE", 0.9))
+MIN_TRAINING_ROWS = int(os.environ.get("URL_CLASSIFIER_MIN_ROWS", 200))
+MIN_POSITIVES = int(os.environ.get("URL_CLASSIFIER_MIN_POSITIVES", 25))
+TASKS = ['directory', 'store_root']  # one binary model each, trained against that task's noise verdicts
+HASH_BITS = 18
+NGRAM_SIZES = (3, 4, 5)
+EPOCHS = 8
+LEARNING_RATE = 0.2
+L2 = 1e-6
+BATCH_URLS = 5000
+NOISE_SAMPLE_PER_CHUNK = 50  # URLs the LLM passed over in a chunk, logged as noise
+NGRAM_PRIME = np.uint64(1099511628211)
+NGRAM_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+HOST = re.compile(r'^[a-z][a-z0-9+.-]*://[^/?#]*', re.IGNORECASE)
+DIGITS = re.compile(r'\d')
+NUMBERS = re.compile(r'\d+')
+
+log_lock = threading.Lock()
+model_lock = threading.Lock()
+_model = None
+_model_mtime = None
+
+
+def labels_path():
+    return os.path.join(CLASSIFIER_DIR, 'labels.jsonl')
+
+
+def model_path():
+    return os.path.join(CLASSIFIER_DIR, 'model.npz')
+
+
+# --- features -----------------------------------------------------------
+
+def url_path(url):
+    """Lowercased path and query, without host or fragment"""
+    return HOST.sub('', url.strip()).lower().split('#')[0]
+
+
+def token_names(path):
+    """Path-shape features; the character n-grams are hashed separately, in bulk"""
+    path, _, query = path.partition('?')
+    segments = [s for s in path.split('/') if s]
+    names = [f"depth:{min(len(segments), 6)}", f"query:{bool(query)}", f"slash:{path.endswith('/')}"]
+    for position, segment in enumerate(segments):
+        names.append(f"seg:{segment}")
+        if position < 3:
+            names.append(f"seg{position}:{segment}")
+    if segments:
+        last = segments[-1]
+        digits = len(DIGITS.findall(last))
+        names += [f"last:{last}", f"last_digits:{min(digits, 4)}", f"last_len:{min(len(last) // 8, 5)}",
+                  f"last_hyphens:{min(last.count('-'), 4)}"]
+        if len(segments) > 1:
+            names.append(f"parent:{segments[-2]}")
+    return names
+
+
+def ngram_hashes(texts):
+    """(row, hash) arrays for every byte n-gram of every text, rolling-hashed with numpy (no per-gram Python)"""
+    encoded = [text.encode() for text in texts]
+    starts = np.cumsum([0] + [len(b) + 1 for b in encoded[:-1]])
+    data = np.frombuffer(b'\n'.join(encoded) + b'\n', dtype=np.uint8).astype(np.uint64)
+    newlines = np.concatenate(([0], np.cumsum(data == 10)))
+    rows, hashes = [], []
+    for n in NGRAM_SIZES:
+        count = len(data) - n + 1
+        if count <= 0:
+            continue
+        h = np.full(count, n, dtype=np.uint64)
+        for k in range(n):
+            h = h * NGRAM_PRIME + data[k:k + count]
+        h ^= h >> np.uint64(29)
+        h *= NGRAM_MIX
+        h ^= h >> np.uint64(32)
+        positions = np.flatnonzero(newlines[n:n + count] == newlines[:count])  # windows within one text
+        rows.append(np.searchsorted(starts, positions, side='right') - 1)
+        hashes.append(h[positions])
+    return np.concatenate(rows), np.concatenate(hashes)
+
+
+def hashed_features(urls):
+    """(indices, rows): hashed feature indices of every URL, deduplicated, grouped by URL in order"""
+    mask = (1 << HASH_BITS) - 1
+    if not urls:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    paths = [url_path(url) for url in urls]
+    names = [token_names(path) for path in paths]
+    token_rows = np.repeat(np.arange(len(paths)), [len(n) for n in names])
+    token_hashes = np.fromiter(map(zlib.crc32, map(str.encode, chain.from_iterable(names))), dtype=np.int64)
+    gram_rows, gram_hashes = ngram_hashes([f"^{path}$" for path in paths])
+    rows = np.concatenate((token_rows, gram_rows))
+    indices = np.concatenate((token_hashes, gram_hashes.astype(np.int64))) & mask
+    keys = np.sort((rows << HASH_BITS) | indices)
+    keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+    return keys & mask, keys >> HASH_BITS
+
+
+def features(urls):
+    """Hashed feature indices per URL (stable across processes)"""
+    indices, rows = hashed_features(urls)
+    return np.split(indices, np.cumsum(np.bincount(rows, minlength=len(urls)))[:-1])
+
+
+# --- verdict log --------------------------------------------------------
+
+def record_verdicts(task, verdicts):
+    """Append (url, label) pairs decided by the LLM for task ('directory' or 'store_root')"""
+    now = time.time()
+    lines = [json.dumps({'url': url, 'label': label, 'task': task, 'domain': urlsplit(url).netloc, 'ts': now})
+             for url, label in verdicts if label in (task, 'noise')]
+    if not lines:
+        return
+    with log_lock:
+        try:
+            os.makedirs(CLASSIFIER_DIR, exist_ok=True)
+            with open(labels_path(), 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+        except OSError as e:
+            print(f"Could not log URL verdicts: {e}")
+
+
+def sample_noise(urls, picked, limit=NOISE_SAMPLE_PER_CHUNK):
+    """A stable sample of the URLs the LLM passed over, to teach the model what noise looks like.
+    One URL per path shape (digits ignored) comes first, so a handful of /contact/ pages are not
+    drowned out by thousands of store pages"""
+    rest = sorted((url for url in urls if url not in picked), key=lambda url: zlib.crc32(url.encode()))
+    shapes = {}
+    for url in rest:
+        shapes.setdefault(NUMBERS.sub('0', url_path(url)), url)
+    firsts = list(shapes.values())[:limit]
+    chosen = set(firsts)
+    return firsts + [url for url in rest if url not in chosen][:limit - len(firsts)]
+
+
+def load_verdicts():
+    """Latest row per (task, url)"""
+    rows = {}
+    try:
+        with open(labels_path(), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                if row.get('task') in TASKS and row.get('label') in (row['task'], 'noise'):
+                    rows[(row['task'], row.get('url'))] = row
+    except FileNotFoundError:
+        pass
+    return list(rows.values())
+
+
+# --- model --------------------------------------------------------------
+
+def sigmoid(scores):
+    return 1 / (1 + np.exp(-np.clip(scores, -30, 30)))
+
+
+def fit(samples, targets, epochs=EPOCHS, seed=0):
+    """Logistic regression by SGD on sparse binary features, classes weighted by inverse frequency"""
+    weights = np.zeros(1 << HASH_BITS, dtype=np.float32)
+    bias = 0.0
+    positives = max(int(targets.sum()), 1)
+    negatives = max(len(targets) - int(targets.sum()), 1)
+    class_weight = (len(targets) / (2 * negatives), len(targets) / (2 * positives))
+    rng = np.random.default_rng(seed)
+    order = np.arange(len(samples))
+    for epoch in range(epochs):
+        rng.shuffle(order)
+        rate = LEARNING_RATE / (1 + epoch)
+        for i in order:
+            indices, target = samples[i], targets[i]
+            gradient = (sigmoid(weights[indices].sum() + bias) - target) * class_weight[target] * rate
+            weights[indices] -= gradient + L2 * weights[indices]
+            bias -= gradient
+    return weights, bias
+
+
+def predict(weights, bias, urls):
+    """P(positive) per URL, scored in batches"""
+    results = []
+    for start in range(0, len(urls), BATCH_URLS):
+        batch = urls[start:start + BATCH_URLS]
+        indices, rows = hashed_features(batch)
+        scores = np.bincount(rows, weights=weights[indices], minlength=len(batch))
+        results.append(sigmoid(scores + bias))
+    return np.concatenate(results) if results else np.zeros(0)
+
+
+def train_task(rows):
+    """(weights, bias, summary) for one task's verdicts, or (None, None, summary) if there are too few"""
+    targets = np.array([row['label'] != 'noise' for row in rows], dtype=np.int64)
+    summary = {'rows': len(rows), 'positives': int(targets.sum())}
+    if len(rows) < MIN_TRAINING_ROWS or not MIN_POSITIVES <= targets.sum() < len(rows):
+        summary['error'] = f"Need at least {MIN_TRAINING_ROWS} verdicts, {MIN_POSITIVES} of them positive"
+        return None, None, summary
+
+    # Hold out whole sites, to measure how the model does on a site it has not seen
+    held_out = np.array([zlib.crc32(row['domain'].encode()) % 5 == 0 for row in rows])
+    if held_out.all() or not held_out.any():
+        held_out = np.arange(len(rows)) % 5 == 0
+    samples = features([row['url'] for row in rows])
+    train_idx, test_idx = np.flatnonzero(~held_out), np.flatnonzero(held_out)
+    weights, bias = fit([samples[i] for i in train_idx], targets[train_idx])
+    probabilities = predict(weights, bias, [rows[i]['url'] for i in test_idx])
+    correct = (probabilities >= 0.5) == targets[test_idx]
+    confident = np.maximum(probabilities, 1 - probabilities) >= CONFIDENCE
+    summary.update({
+        'holdout_rows': len(test_idx),
+        'holdout_accuracy': round(float(correct.mean()), 4),
+        'holdout_confident_share': round(float(confident.mean()), 4),
+        'holdout_confident_accuracy': round(float(correct[confident].mean()), 4) if confident.any() else None,
+    })
+
+    # The saved model is fit on every verdict
+    weights, bias = fit(samples, targets)
+    return weights, bias, summary
+
+
+def train():
+    """Fit one model per task on the verdict log and save them. Returns per-task summaries"""
+    rows = load_verdicts()
+    arrays, summary = {}, {'trained_at': time.time(), 'tasks': {}}
+    for task in TASKS:
+        weights, bias, summary['tasks'][task] = train_task([row for row in rows if row['task'] == task])
+        if weights is not None:
+            arrays[f'{task}_weights'] = weights
+            arrays[f'{task}_bias'] = np.array(bias)
+    summary['trained'] = bool(arrays)
+    if not arrays:
+        return summary
+
+    os.makedirs(CLASSIFIER_DIR, exist_ok=True)
+    tmp_path = model_path() + '.tmp.npz'
+    np.savez_compressed(tmp_path, summary=np.array(json.dumps(summary)), **arrays)
+    os.replace(tmp_path, model_path())
+    return summary
+
+
+def get_model():
+    """{task: (weights, bias)} plus 'summary', reloaded when the file changes; None if there is none"""
+    global _model, _model_mtime
+    try:
+        mtime = os.path.getmtime(model_path())
+    except OSError:
+        return None
+    with model_lock:
+        if _model is None or mtime != _model_mtime:
+            try:
+                with np.load(model_path()) as data:
+                    model = {'summary': json.loads(str(data['summary']))}
+                    for task in TASKS:
+                        if f'{task}_weights' in data:
+                            model[task] = (data[f'{task}_weights'], float(data[f'{task}_bias']))
+                _model, _model_mtime = model, mtime
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Could not load URL classifier: {e}")
+                return None
+        return _model
+
+
+def classify(task, urls):
+    """P(url is a `task` URL) per URL, or None without a trained model for task"""
+    model = get_model()
+    if model is None or task not in model:
+        return None
+    weights, bias = model[task]
+    return predict(weights, bias, list(urls))
+
+
+def triage(service, task, urls):
+    """(confident matches, uncertain URLs). URLs the model is confident are noise are dropped;
+    without a model every URL is uncertain"""
+    probabilities = classify(task, urls) if urls else None
+    if probabilities is None:
+        return [], list(urls)
+    matches = [url for url, p in zip(urls, probabilities) if p >= CONFIDENCE]
+    uncertain = [url for url, p in zip(urls, probabilities) if 1 - CONFIDENCE < p < CONFIDENCE]
+    metrics.URL_CLASSIFICATIONS.inc(service, task, 'match', amount=len(matches))
+    metrics.URL_CLASSIFICATIONS.inc(service, task, 'uncertain', amount=len(uncertain))
+    metrics.URL_CLASSIFICATIONS.inc(service, task, 'noise', amount=len(urls) - len(matches) - len(uncertain))
+    return matches, uncertain
+
+
+def register_endpoint(app):
+    """Add GET /url-classifier (model summary) and POST /url-classifier/train"""
+    from flask import jsonify
+
+    def status_endpoint():
+        model = get_model()
+        return jsonify({'model': model['summary'] if model else None, 'confidence_threshold': CONFIDENCE})
+
+    def train_endpoint():
+        summary = train()
+        return jsonify(summary), 200 if summary['trained'] else 400
+
+    app.add_url_rule('/url-classifier', 'url_classifier', status_endpoint, methods=['GET'])
+    app.add_url_rule('/url-classifier/train', 'url_classifier_train', train_endpoint, methods=['POST'])
+
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:] != ['train']:
+        sys.exit("usage: python -m url_classifier train")
+    print(json.dumps(train(), indent=2))
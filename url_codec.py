@@ -0,0 +1,92 @@
+"""
+Compact URL listings for LLM prompts.
+
+Shared hosts and parent paths are written once as short labels and each URL becomes a numbered fragment:
+
+    {A} = https://www.mall.example/en/stores/
+    1. {A}
+    2. {A}zara/
+
+The model answers with the numbers, which decode_indices maps back to the exact URLs, so nothing it
+writes can turn into a URL that was not in the list.
+"""
+from string import ascii_uppercase
+from urllib.parse import urlsplit
+
+MIN_GROUP = 2  # a parent path gets its own label once this many listed URLs share it
+
+
+def label(n):
+    """A, B, ..., Z, AA, AB, ..."""
+    name = ''
+    n += 1
+    while n:
+        n, rest = divmod(n - 1, 26)
+        name = ascii_uppercase[rest] + name
+    return name
+
+
+def split_url(url):
+    """(prefix, fragment): origin plus parent directory, and the last path segment with query/fragment"""
+    parts = urlsplit(url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    path = parts.path or '/'
+    # /en/stores/zara/ and /en/stores/zara both sit under /en/stores/
+    cut = path.rstrip('/').rfind('/') + 1
+    tail = url[len(origin) + cut:]
+    return origin + path[:cut], tail
+
+
+def encode_urls(urls):
+    """(ordered URLs, prompt text). Line i of the text is URL ordered[i - 1]"""
+    urls = list(dict.fromkeys(urls))
+    splits = {url: split_url(url) for url in urls}
+
+    counts = {}
+    for url in urls:
+        prefix = splits[url][0]
+        counts[prefix] = counts.get(prefix, 0) + 1
+    # A URL that is itself a shared prefix is listed under that prefix, as the empty fragment
+    for url in urls:
+        if counts.get(url, 0) >= MIN_GROUP:
+            splits[url] = (url, '')
+
+    prefixes = {}
+    for url in urls:
+        prefix, tail = splits[url]
+        if counts.get(prefix, 0) < MIN_GROUP and prefix != url:
+            # Lone parent directory: fall back to host label + full path
+            parts = urlsplit(url)
+            prefix = f"{parts.scheme}://{parts.netloc}"
+            tail = url[len(prefix):]
+            splits[url] = (prefix, tail)
+        prefixes.setdefault(prefix, None)
+
+    names = {prefix: label(n) for n, prefix in enumerate(sorted(prefixes))}
+    ordered = sorted(urls, key=lambda u: (splits[u][0], splits[u][1]))
+
+    legend = '\n'.join(f"{{{names[prefix]}}} = {prefix}" for prefix in sorted(prefixes))
+    lines = '\n'.join(f"{i}. {{{names[splits[url][0]]}}}{splits[url][1]}" for i, url in enumerate(ordered, 1))
+    return ordered, f"{legend}\n\n{lines}"
+
+
+def decode_indices(values, ordered):
+    """Map the model's answer (numbers, numeric strings, or exact listed URLs) back to listed URLs"""
+    listed = set(ordered)
+    picked = []
+    for value in values if isinstance(values, list) else []:
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, str) and value in listed:
+            url = value
+        else:
+            try:
+                index = int(str(value).strip().lstrip('#').rstrip('.'))
+            except ValueError:
+                continue
+            if not 1 <= index <= len(ordered):
+                continue
+            url = ordered[index - 1]
+        if url not in picked:
+            picked.append(url)
+    return picked
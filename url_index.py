@@ -0,0 +1,51 @@
+"""
+Substring index over a crawl's URLs, for filtering by many root patterns without rescanning Python lists.
+
+The URLs are lowercased once, sorted, and joined into one newline-separated text with a table of line offsets.
+A pattern is found with str.find over that text (a C-speed scan). Each hit is widened with bisect to every
+following URL that shares the hit URL's prefix up to the end of the match, since those contain the pattern
+too; a root like /en/stores/ then costs a couple of finds and one list slice, however many stores it has.
+"""
+from bisect import bisect_left, bisect_right
+
+PREFIX_END = '\U0010ffff'
+
+
+class URLIndex:
+    def __init__(self, urls):
+        self.urls = sorted(set(urls), key=str.lower)
+        self.lowered = [url.lower() for url in self.urls]
+        self.text = '\n'.join(self.lowered) + '\n'
+        self.offsets = []
+        position = 0
+        for lowered in self.lowered:  # lower() can change the length (e.g. 'İ'), so offsets use the lowered form
+            self.offsets.append(position)
+            position += len(lowered) + 1
+
+    def __len__(self):
+        return len(self.urls)
+
+    def find(self, pattern):
+        """Sorted URLs containing pattern, case-insensitively (same test as `pattern.lower() in url.lower()`)"""
+        needle = pattern.lower()
+        if not needle:
+            return sorted(self.urls)
+        if '\n' in needle:
+            return []
+        text, offsets, lowered = self.text, self.offsets, self.lowered
+        found = []
+        position = text.find(needle)
+        while position != -1:
+            line = bisect_right(offsets, position) - 1
+            prefix = lowered[line][:position - offsets[line] + len(needle)]
+            end = bisect_left(lowered, prefix + PREFIX_END, line)
+            found.extend(self.urls[line:end])
+            if end == len(offsets):
+                break
+            position = text.find(needle, offsets[end])
+        found.sort()
+        return found
+
+    def match(self, patterns):
+        """{pattern: sorted matching URLs} for every pattern"""
+        return {pattern: self.find(pattern) for pattern in dict.fromkeys(patterns)}